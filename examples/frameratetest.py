@@ -16,15 +16,15 @@ disp.add_photodiode((0, 0, 50, 50))
 
 R = 128
 C = 128
-xx = np.arange(C).reshape((1,C))
-yy = np.arange(R).reshape((R,1))
+xx = np.arange(C).reshape((1,1,C))
+yy = np.arange(R).reshape((1,R,1))
 K = 16
+kk = np.arange(K*10).reshape((K*10,1,1))
 
 stim = stimulus.Stimulus()
-for k in range(K*10):
-    ar = np.cos(xx*20/C + k/K*2*np.pi) + 0*yy
-    ar *= np.exp(-.5*((xx-C/2)**2 + (yy-R/2)**2)/(C/6)**2)
-    stim.add_image_from_array((128+100*ar).astype(np.uint8))
+ar = np.cos(xx*20/C + kk/K*2*np.pi) + 0*yy
+ar *= np.exp(-.5*((xx-C/2)**2 + (yy-R/2)**2)/(C/6)**2)
+stim.add_images((128+100*ar).astype(np.uint8), dedupe=True)
 
 stim.set_refresh_rate(20)
 stim.set_initial_delay(.5)
@@ -40,4 +40,4 @@ disp.run(stim, target=(x0,y0,x1-x0,y1-y0))
 print(f'{1e3*np.mean(np.diff(times)):.2f} ms',
       '±',
       f'{1000*np.std(np.diff(times)):.2f} ms')
-
+print(disp.last_run_timing())
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+'''BENCH - Headless benchmark of the display's paint path
+
+Run as
+
+    python3 -m stimcore.bench
+
+to render a matrix of image sizes, target rectangles, sequence lengths,
+and storage modes as fast as possible, without a real display. Each
+configuration runs in a fresh process, so that its peak memory use can
+be measured. Use --help for options. For each configuration, BENCH
+reports the time spent preparing the run (pre-scaling and the like),
+the mean time per frame spent fetching and scaling the next image and
+spent painting it (including photodiodes, GPIO, and callbacks), the
+resulting frame rate, and the peak resident memory.'''
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import resource
+import subprocess
+import numpy as np
+
+
+def _make_stimulus(stimulus, mode, size, length, tmpdir, unique=16):
+    w, h = size
+    rng = np.random.default_rng(1)
+    stack = rng.integers(0, 256, (unique, h, w), dtype=np.uint8)
+    if mode=='memory':
+        stim = stimulus.Stimulus()
+        stim.add_images(stack)
+    elif mode=='stack':
+        fn = os.path.join(tmpdir, 'stack.npy')
+        np.save(fn, stack)
+        stim = stimulus.Stimulus()
+        stim.add_image_stack(fn)
+    elif mode=='lazy':
+        from PyQt5.QtGui import QImage
+        stim = stimulus.Stimulus(lazy=True, cache_mb=64)
+        for n in range(unique):
+            fn = os.path.join(tmpdir, f'{n}.png')
+            ar = np.ascontiguousarray(stack[n])
+            QImage(ar.data, w, h, w, QImage.Format_Grayscale8).save(fn)
+            stim.add_image_from_file(fn)
+    else:
+        raise ValueError(f'Unknown storage mode: {mode}')
+    stim.set_order([k % unique for k in range(length)])
+    stim.set_refresh_rate(1000)
+    return stim
+
+
+def run_one(config):
+    '''RUN_ONE - Benchmark a single configuration
+    res = RUN_ONE(config), where CONFIG is a dict with keys SIZE
+    (image width and height), TARGET ("full" or an [x,y,w,h] quad),
+    LENGTH (number of frames), MODE ("memory", "stack", or "lazy"), and
+    SCREEN (window width and height), renders all frames into a QImage
+    and returns a dict of timings (in seconds) and peak RSS (in MB).
+    This runs in the current process, so peak RSS includes whatever
+    the process did before.'''
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtCore import QPoint
+    from . import stimulus, display, gpio
+    gpio.set_backend(gpio.RecordingBackend())
+
+    disp = display.Display(full_screen=False)
+    d = disp._disp
+    d.resize(*config['screen'])
+    disp.add_photodiode((0, 0, 50, 50))
+    disp.add_gpio(17)
+    disp.add_callback(lambda k, t: None)
+    target = None if config['target']=='full' else config['target']
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stim = _make_stimulus(stimulus, config['mode'], config['size'],
+                              config['length'], tmpdir)
+        canvas = QImage(d.width(), d.height(), QImage.Format_RGB32)
+        t0 = time.perf_counter()
+        d.prepare(stim, target, config.get('smooth', False))
+        t1 = time.perf_counter()
+        t_fetch = 0
+        t_paint = 0
+        for k in range(d.N):
+            ta = time.perf_counter()
+            d.timeout() # Fetches and scales the next image
+            tb = time.perf_counter()
+            if k==0:
+                d.render(canvas) # Runs paintEvent
+            else:
+                d.render(canvas, QPoint(0, 0), d.dirty)
+            tc = time.perf_counter()
+            t_fetch += tb - ta
+            t_paint += tc - tb
+        t2 = time.perf_counter()
+        d.scheduler.stop()
+        gpio.flush()
+    N = config['length']
+    return {'prepare': t1 - t0,
+            'fetch': t_fetch / N,
+            'paint': t_paint / N,
+            'fps': N / (t2 - t1),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                           / 1024}
+
+
+def _parse_size(s):
+    w, h = s.split('x')
+    return [int(w), int(h)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m stimcore.bench',
+                                     description='Headless benchmark of'
+                                     ' the stimcore paint path')
+    parser.add_argument('--sizes', default='32x18,640x360,1920x1080',
+                        help='Comma-separated image sizes (WxH)')
+    parser.add_argument('--targets', default='full,small',
+                        help='Comma-separated targets: "full" or "small"')
+    parser.add_argument('--lengths', default='100,1000',
+                        help='Comma-separated sequence lengths')
+    parser.add_argument('--modes', default='memory,stack,lazy',
+                        help='Comma-separated storage modes')
+    parser.add_argument('--screen', default='1920x1080',
+                        help='Size of the display window (WxH)')
+    parser.add_argument('--smooth', action='store_true',
+                        help='Use smooth rather than nearest-neighbor scaling')
+    parser.add_argument('--json', action='store_true',
+                        help='Write results as JSON lines rather than a table')
+    parser.add_argument('--one', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.one:
+        print(json.dumps(run_one(json.loads(args.one))))
+        return
+
+    screen = _parse_size(args.screen)
+    small = [screen[0]//2 - 80, screen[1]//2 - 45, 160, 90]
+    configs = []
+    for size in args.sizes.split(','):
+        for target in args.targets.split(','):
+            for length in args.lengths.split(','):
+                for mode in args.modes.split(','):
+                    configs.append({'size': _parse_size(size),
+                                    'target': small if target=='small'
+                                              else 'full',
+                                    'length': int(length),
+                                    'mode': mode,
+                                    'screen': screen,
+                                    'smooth': args.smooth})
+
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    pkgroot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([pkgroot]
+                                        + env.get('PYTHONPATH', '').split(
+                                            os.pathsep))
+    if not args.json:
+        print(f'{"size":>10} {"target":>7} {"length":>6} {"mode":>6}'
+              f' {"prep(s)":>8} {"fetch(ms)":>9} {"paint(ms)":>9}'
+              f' {"fps":>8} {"RSS(MB)":>8}')
+    for config in configs:
+        out = subprocess.run([sys.executable, '-m', 'stimcore.bench',
+                              '--one', json.dumps(config)],
+                             env=env, capture_output=True, text=True)
+        lines = out.stdout.strip().split('\n')
+        if out.returncode != 0 or not lines[-1].startswith('{'):
+            print(f'Configuration {config} failed:', file=sys.stderr)
+            print(out.stderr, file=sys.stderr)
+            continue
+        res = json.loads(lines[-1])
+        if args.json:
+            print(json.dumps({**config, **res}))
+        else:
+            w, h = config['size']
+            tgt = 'full' if config['target']=='full' else 'small'
+            print(f'{w:>4}x{h:<5} {tgt:>7} {config["length"]:>6}'
+                  f' {config["mode"]:>6} {res["prepare"]:>8.3f}'
+                  f' {1e3*res["fetch"]:>9.3f} {1e3*res["paint"]:>9.3f}'
+                  f' {res["fps"]:>8.1f} {res["peak_rss_mb"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+'''BUNDLE - Compiled stimulus files
+
+A bundle holds everything about a STIMULUS in a single file: decoded
+pixel data, labels, presentation order, refresh rate, delays, and
+background color. Loading a bundle does not decode anything: the file
+is memory-mapped and its images are presented directly from the map,
+as for STIMULUS.ADD_IMAGE_STACK.
+
+The file starts with the 8-byte magic string "STIMBNDL", a 32-bit
+version number, 32 reserved bits, and a 64-bit header length, all
+little-endian. Next follows a JSON header of that length, and then the
+raw pixel data of each image (HxW or HxWx3 uint8, without padding;
+images with an alpha channel are stored as HxWx4 uint8 holding QImage's
+premultiplied ARGB32 pixels, i.e., B, G, R, A on little-endian machines),
+the presentation order (int64), and, for an order with durations
+(see STIMULUS.SET_TIMED_ORDER), the durations (float64), each starting
+at a multiple of ALIGN bytes. The header gives the offset and shape
+of each block.'''
+
+import json
+import numpy as np
+from PyQt5.QtGui import QImage, QPixmap
+from . import render
+from . import orders
+
+MAGIC = b'STIMBNDL'
+VERSION = 1
+ALIGN = 64
+
+
+def _as_array(img):
+    '''Convert a QImage or QPixmap to an HxW, HxWx3, or HxWx4 uint8 array'''
+    if isinstance(img, QPixmap):
+        img = img.toImage()
+    if img.isNull():
+        return np.zeros((0, 0), np.uint8)
+    if img.hasAlphaChannel():
+        img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        C = 4
+    elif img.isGrayscale():
+        img = img.convertToFormat(QImage.Format_Grayscale8)
+        C = 1
+    else:
+        img = img.convertToFormat(QImage.Format_RGB888)
+        C = 3
+    w = img.width()
+    h = img.height()
+    bpl = img.bytesPerLine()
+    ar = np.frombuffer(img.constBits().asstring(bpl*h), np.uint8)
+    ar = ar.reshape(h, bpl)[:, :C*w]
+    if C>1:
+        ar = ar.reshape(h, w, C)
+    return ar
+
+
+def _padding(pos):
+    return (-pos) % ALIGN
+
+
+def save(stim, path, target=None, smooth=False):
+    '''SAVE - Save a stimulus as a bundle
+    SAVE(stim, path) writes all images of the STIMULUS along with its
+    labels, order, refresh rate, delays, and background color to a
+    single file.
+    Optional argument TARGET, an (x,y,w,h)-quad in pixels, pre-scales
+    all images to the size they will have when shown in that target
+    rectangle, so that no scaling is needed at presentation time. Their
+    positions within the target are recorded as well, so that they
+    are placed exactly where the originals would have been.
+    Optional argument SMOOTH selects smooth rather than nearest-neighbor
+    scaling for that.
+    Images that share storage (see STIMULUS.ADD_IMAGES) are stored once.'''
+    if stim.is_composite():
+        raise ValueError('Composite stimuli cannot be saved as bundles')
+    N = len(stim.fns)
+    blocks = {}   # Maps original IDs to arrays
+    positions = {} # Maps original IDs to positions of pre-scaled images
+    entries = []
+    for k in range(N):
+        orig = stim.original_id(k)
+        if orig not in blocks:
+            img = stim.images[orig]
+            if type(img)==tuple and target is None:
+                stack, n = img
+                blocks[orig] = np.ascontiguousarray(stack[n])
+            else:
+                img = stim.get_image(orig)
+                if target is not None:
+                    img, x, y = render.scale_image(img, target, smooth)
+                    if img is None:
+                        img = QImage()
+                    positions[orig] = [x, y]
+                blocks[orig] = _as_array(img)
+        entries.append(orig)
+    order = stim.order
+    durations = None
+    unit = None
+    if isinstance(order, orders.Stream):
+        raise ValueError('Orders produced on demand cannot be saved')
+    if isinstance(order, orders.RunLength):
+        durations = order.durations
+        unit = order.unit
+        order = order.ids
+    elif order is not None:
+        order = np.asarray(order, np.int64)
+
+    # Lay out the file
+    header = {'labels': [str(fn) for fn in stim.fns],
+              'f_Hz': stim.f_Hz,
+              'initial_delay_s': stim.initial_delay_s,
+              'final_delay_s': stim.final_delay_s,
+              'background': [int(c) for c in stim.background],
+              'target': None if target is None else [int(x) for x in target],
+              'smooth': bool(smooth),
+              'images': [],
+              'order': None}
+    # The offsets depend on the length of the header, which in turn
+    # depends on the offsets, so iterate until the layout is stable.
+    def layout(pos):
+        offsets = {}
+        for orig in blocks:
+            pos += _padding(pos)
+            offsets[orig] = pos
+            pos += blocks[orig].nbytes
+        header['images'] = [{'offset': offsets[orig],
+                             'shape': list(blocks[orig].shape),
+                             'original': orig,
+                             'position': positions.get(orig)}
+                            for orig in entries]
+        if order is not None:
+            pos += _padding(pos)
+            header['order'] = {'offset': pos, 'count': len(order)}
+            pos += order.nbytes
+        if durations is not None:
+            pos += _padding(pos)
+            header['order']['durations'] = pos
+            header['order']['unit'] = unit
+        return json.dumps(header).encode('utf8')
+    start = 24
+    while True:
+        hdr = layout(start)
+        need = 24 + len(hdr)
+        need += _padding(need)
+        if need <= start:
+            break
+        start = need
+    hdr += b' ' * (start - 24 - len(hdr))
+
+    with open(path, 'wb') as fd:
+        fd.write(MAGIC)
+        fd.write(np.array([VERSION, 0], '<u4').tobytes())
+        fd.write(np.array([len(hdr)], '<u8').tobytes())
+        fd.write(hdr)
+        pos = start
+        written = set()
+        for ent in header['images']:
+            orig = ent['original']
+            if orig in written:
+                continue
+            fd.write(b'\0' * (ent['offset'] - pos))
+            data = blocks[orig].tobytes()
+            fd.write(data)
+            pos = ent['offset'] + len(data)
+            written.add(orig)
+        if order is not None:
+            fd.write(b'\0' * (header['order']['offset'] - pos))
+            fd.write(order.astype('<i8').tobytes())
+            pos = header['order']['offset'] + order.nbytes
+        if durations is not None:
+            fd.write(b'\0' * (header['order']['durations'] - pos))
+            fd.write(durations.astype('<f8').tobytes())
+
+
+def load(stim, path):
+    '''LOAD - Load a bundle into a stimulus
+    LOAD(stim, path) adds all the images of the bundle file PATH to the
+    empty STIMULUS and sets its order, refresh rate, delays, and
+    background color from the bundle. Images are memory-mapped, not
+    read. If the images were pre-scaled, STIMULUS.SCALE_IMAGE returns
+    them without further scaling for the same target. Returns the
+    header of the bundle as a dict; its TARGET and SMOOTH entries
+    record how the images were pre-scaled, if at all.'''
+    if stim.fns:
+        raise ValueError('Can only load a bundle into an empty stimulus')
+    mm = np.memmap(path, np.uint8, 'r')
+    if bytes(mm[:8]) != MAGIC:
+        raise ValueError(f'Not a stimulus bundle: {path}')
+    version, _ = np.frombuffer(bytes(mm[8:16]), '<u4')
+    if version != VERSION:
+        raise ValueError(f'Unsupported bundle version: {version}')
+    hlen = int(np.frombuffer(bytes(mm[16:24]), '<u8')[0])
+    header = json.loads(bytes(mm[24:24+hlen]).decode('utf8'))
+
+    for k, ent in enumerate(header['images']):
+        shp = tuple(ent['shape'])
+        off = ent['offset']
+        ar = mm[off:off + int(np.prod(shp))].reshape((1,) + shp)
+        stim.fns.append(header['labels'][k])
+        stim.images.append((ar, 0))
+        if ent['original'] != k:
+            stim.same_as[k] = ent['original']
+    if header['order'] is not None:
+        off = header['order']['offset']
+        cnt = header['order']['count']
+        order = np.frombuffer(mm, '<i8', cnt, off)
+        if 'durations' in header['order']:
+            off = header['order']['durations']
+            durations = np.frombuffer(mm, '<f8', cnt, off)
+            stim.order = orders.RunLength(order, durations,
+                                          header['order']['unit'])
+        else:
+            stim.order = order # Stays in the memory map
+    if header['target'] is not None:
+        stim.prescaled = {'target': tuple(header['target']),
+                          'smooth': header['smooth'],
+                          'positions': [tuple(ent['position'])
+                                        for ent in header['images']]}
+    stim.f_Hz = header['f_Hz']
+    stim.initial_delay_s = header['initial_delay_s']
+    stim.final_delay_s = header['final_delay_s']
+    stim.background = header['background']
+    return header
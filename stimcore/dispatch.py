@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+import time
+import queue
+import threading
+import warnings
+
+
+class Dispatcher:
+    '''Class DISPATCHER: Calls frame callbacks
+    A DISPATCHER calls functions with a frame number and a time whenever
+    a new frame is shown. Ordinary callbacks are either called directly
+    (the default) or, in threaded mode, handed to a worker thread through
+    a queue, so that slow callbacks cannot delay frames. "Critical"
+    callbacks are always called directly, and their duration is checked
+    against an optional time budget: frames in which they overrun it
+    are counted, and REPORT issues a single warning at the end of a run,
+    so that the paint path is not slowed down further by the warnings.'''
+
+    def __init__(self):
+        self.callbacks = []
+        self.critical = []
+        self.threaded = False
+        self.budget_s = None
+        self.overruns = 0
+        self.worst_s = 0
+        # The queue counts frames until their callbacks have returned,
+        # so that FLUSH cannot return while the last one is running.
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def add(self, cb, critical=False):
+        '''ADD - Add a callback
+        ADD(cb) adds an ordinary callback. ADD(cb, critical=True) adds
+        a critical callback.'''
+        if critical:
+            self.critical.append(cb)
+        else:
+            self.callbacks.append(cb)
+
+    def set_threaded(self, threaded):
+        '''SET_THREADED - Call ordinary callbacks from a worker thread'''
+        self.stop()
+        self.threaded = threaded
+
+    def set_budget(self, dt_s):
+        '''SET_BUDGET - Set the time budget for critical callbacks
+        SET_BUDGET(dt_s) causes frames in which the critical callbacks
+        together take longer than DT_S seconds to be counted as overruns.
+        SET_BUDGET(None) disables the check.'''
+        self.budget_s = dt_s
+
+    def reset(self):
+        '''RESET - Reset the overrun statistics'''
+        self.overruns = 0
+        self.worst_s = 0
+
+    def notify(self, k, t):
+        '''NOTIFY - Dispatch a frame to all callbacks'''
+        if self.critical:
+            t0 = time.perf_counter()
+            for cb in self.critical:
+                cb(k, t)
+            dt = time.perf_counter() - t0
+            self.worst_s = max(self.worst_s, dt)
+            if self.budget_s is not None and dt > self.budget_s:
+                self.overruns += 1
+        if not self.callbacks:
+            return
+        if self.threaded:
+            self.queue.put((k, t))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._work,
+                                               daemon=True)
+                self.thread.start()
+        else:
+            for cb in self.callbacks:
+                cb(k, t)
+
+    def report(self):
+        '''REPORT - Warn about overruns since the last RESET'''
+        if self.overruns:
+            warnings.warn(f'Critical callbacks exceeded budget of'
+                          f' {1e3*self.budget_s:.2f} ms in {self.overruns}'
+                          f' frames (worst: {1e3*self.worst_s:.2f} ms)')
+
+    def flush(self):
+        '''FLUSH - Wait until the worker thread has handled all frames'''
+        self.queue.join()
+
+    def stop(self):
+        '''STOP - Handle all frames, then end the worker thread
+        The thread is started again when a frame is next dispatched.'''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            k, t = item
+            for cb in self.callbacks:
+                try:
+                    cb(k, t)
+                except Exception as e:
+                    print(f'Callback failed in frame {k}: {e}')
+            self.queue.task_done()
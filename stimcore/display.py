@@ -1,18 +1,33 @@
 #!/usr/bin/python3
 
-from PyQt5.QtWidgets import QWidget, QApplication
-from PyQt5.QtCore import Qt, QTimer, QRect, QTime
-from PyQt5.QtGui import QPainter, QColor, QCursor, QBitmap
+from PyQt5.QtWidgets import QWidget, QApplication, QOpenGLWidget
+from PyQt5.QtCore import Qt, QEventLoop, QTimer, QRect
+from PyQt5.QtGui import QPainter, QCursor, QBitmap, QRegion, QImage
+from PyQt5.QtGui import QSurfaceFormat
 import time
 import os
+import asyncio
+import warnings
+import collections
+import concurrent.futures
 import numpy as np
 from collections import namedtuple
 from . import gpio
+from . import timing
+from . import scheduler
+from . import sync
+from . import geometry
+from . import render
+from . import dispatch
+from . import orders
+from . import qtapp
 
-class _Display(QWidget):
-    if 'DISPLAY' not in os.environ or os.environ['DISPLAY'] == '':
-        os.environ['DISPLAY'] = ':0'
-    app = QApplication.instance()
+class _DisplayBase:
+    '''_DISPLAYBASE - Logic shared by _DISPLAY and _GLDISPLAY
+    This must be mixed in ahead of a QWidget class.'''
+    app = None
+    prefetch_frames = 8 # How far ahead lazy stimuli are decoded
+    scaled_cache_mb = 256 # Default limit on memory of pre-scaled images
 
     def __init__(self, screen_number=0, full_screen=True):
         '''DISPLAY - Canvas for displaying images
@@ -20,26 +35,39 @@ class _Display(QWidget):
         Optional argument SCREEN_NUMBER specifies the number of the monitor
         on which to display (counting from zero).
         DISPLAY(full_screen=False) creates a smaller window for testing.'''
+        t0 = time.perf_counter()
+        _DisplayBase.app = qtapp.get_app()
 
-        _Display.app = QApplication.instance()
-        if _Display.app is None:
-            _Display.app = QApplication(['stimcore'])
-
-        super(_Display, self).__init__()
+        super(_DisplayBase, self).__init__()
+        # We paint every pixel we are asked to, so Qt need not erase first
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
 
         self.target = None
         self.k = None
         self.stim = None
-        self.callbacks = []
+        self.scaled = collections.OrderedDict() # See SCALED_IMAGE
+        self.scaled_bytes = 0
+        self.scaled_limit = _DisplayBase.scaled_cache_mb * 1024 * 1024
+        self.upcoming = None # Next frame's image, see PREPARE_UPCOMING
+        self.smooth = False
+        self.timing = None
+        self.busy_wait_s = 0
+        self.handle = None
+        self.blocks = []
+        self.timings = []
+        self.block = 0
+        self.t_block = 0
+        self.preload = collections.deque()
+        self.scale_cost = 0.01 # Estimated time to scale one image
+        self.dispatcher = dispatch.Dispatcher()
         self.photodiodes = []
         self.gpios = []
-
-        # The paintEvent causes the app to then exit immediately if k is None.
-        # Oddly, just running processEvents doesn't cause repaint
+        self.leader = None # Display that drives this one, see DISPLAYGROUP
+        self.followers = [] # Displays driven by this one
 
         # If we don't show() first, we don't have a window handle, so
         # we cannot send ourselves to requested screen.
-        scrs = _Display.app.screens()
+        scrs = _DisplayBase.app.screens()
         if screen_number >= len(scrs):
             raise ValueError('Nonexistent screen')
 
@@ -52,15 +80,55 @@ class _Display(QWidget):
         self.screensize = (siz.width(), siz.height())
 
         if full_screen:
-            print(self.screensize)
             self.resize(siz)
             self.showFullScreen()
         else:
             self.resize(self.screensize[0]*480//self.screensize[1], 480)
             self.show()
         self.windowHandle().setScreen(scrs[screen_number])
-        _Display.app.exec() # This forces window to be painted black
         self.setCursor(QCursor(QBitmap(1,1), QBitmap(1,1)))
+        self.paint_now()
+        self.startup_s = time.perf_counter() - t0
+
+    def paint_now(self, timeout_s=1):
+        '''PAINT_NOW - Make sure the window is painted
+        PAINT_NOW() processes Qt events until the window has appeared on
+        the screen (but for at most TIMEOUT_S seconds), and then paints
+        it right away. This does not enter a blocking event loop.'''
+        t_end = time.perf_counter() + timeout_s
+        while (not self.windowHandle().isExposed()
+               and time.perf_counter() < t_end):
+            process_events(0.005)
+        self.repaint()
+        process_events()
+
+    def reset(self):
+        '''RESET - Forget all settings from earlier sessions
+        RESET() removes all photodiodes, GPIOs, and callbacks, drops
+        cached images and the last timing record, and repaints the
+        window, so that the display can be used for a new session
+        without being rebuilt. Any GPIOs are set to zero first, and
+        a run in progress is cancelled.'''
+        if self.handle is not None:
+            self.finish(cancelled=True)
+        if self.gpios:
+            gpio.post([gp.pin for gp in self.gpios], [0]*len(self.gpios))
+            gpio.flush()
+        self.dispatcher.stop()
+        self.dispatcher = dispatch.Dispatcher()
+        self.photodiodes = []
+        self.gpios = []
+        self.scaled.clear()
+        self.scaled_bytes = 0
+        self.scaled_limit = _DisplayBase.scaled_cache_mb * 1024 * 1024
+        self.upcoming = None
+        self.stim = None
+        self.timing = None
+        self.timings = []
+        self.blocks = []
+        self.busy_wait_s = 0
+        self.k = None
+        self.update()
 
     def add_gpio(self, pin, period=2, delay=0):
         '''ADD_GPIO - Add a GPIO signal
@@ -88,12 +156,59 @@ class _Display(QWidget):
         T = namedtuple('PD', ['rect', 'period', 'delay'])
         self.photodiodes.append(T._make((rect, period, delay)))
         
-    def add_callback(self, cb):
+    def add_callback(self, cb, critical=False):
         '''ADD_CALLBACK - Add a function to be called at start of frame
         ADD_CALLBACK(func) causes the given function to be called at
         the start of every frame, with the frame number and the current
-        time (in seconds) as arguments.'''
-        self.callbacks.append(cb)
+        time (in seconds) as arguments.
+        ADD_CALLBACK(func, critical=True) adds a critical callback, which
+        is always called from the paint routine, even in threaded mode
+        (see SET_CALLBACK_MODE).'''
+        self.dispatcher.add(cb, critical)
+
+    def set_callback_mode(self, mode):
+        '''SET_CALLBACK_MODE - Specify how callbacks are called
+        SET_CALLBACK_MODE('inline') causes callbacks to be called directly
+        from the paint routine. This is the default.
+        SET_CALLBACK_MODE('thread') causes (non-critical) callbacks to be
+        called from a worker thread instead, so that slow callbacks do
+        not delay frames.'''
+        if mode not in ('inline', 'thread'):
+            raise ValueError('Callback mode must be "inline" or "thread"')
+        self.dispatcher.set_threaded(mode=='thread')
+
+    def set_critical_budget(self, dt_s):
+        '''SET_CRITICAL_BUDGET - Time budget for critical callbacks
+        SET_CRITICAL_BUDGET(dt_s) causes frames in which the critical
+        callbacks together take longer than DT_S seconds to be counted,
+        with a warning at the end of the run.
+        SET_CRITICAL_BUDGET(None) disables the check.'''
+        self.dispatcher.set_budget(dt_s)
+
+    def critical_overruns(self):
+        '''CRITICAL_OVERRUNS - Budget overruns of critical callbacks
+        (n, worst_s) = CRITICAL_OVERRUNS() returns the number of frames of
+        the most recent run in which critical callbacks exceeded their
+        budget, and the longest time they took in any frame.'''
+        return (self.dispatcher.overruns, self.dispatcher.worst_s)
+
+    def set_scaled_cache(self, mb):
+        '''SET_SCALED_CACHE - Limit the memory used by pre-scaled images
+        SET_SCALED_CACHE(mb) limits the memory used by images that are
+        kept scaled to their on-screen size to MB megabytes, dropping
+        the least recently used ones if needed.'''
+        self.scaled_limit = int(mb * 1024 * 1024)
+        self._trim_scaled()
+
+    def memory_usage(self):
+        '''MEMORY_USAGE - Memory used by pre-scaled images, in bytes'''
+        return self.scaled_bytes
+
+    def _trim_scaled(self):
+        # The most recent image is kept even if it alone exceeds the limit
+        while self.scaled_bytes > self.scaled_limit and len(self.scaled) > 1:
+            key1, res1 = self.scaled.popitem(last=False)
+            self.scaled_bytes -= _image_bytes(res1[0])
 
     def width_pixels(self):
         '''WIDTH_PIXELS - Width of the window in pixels
@@ -142,154 +257,785 @@ class _Display(QWidget):
         hmm = sizmm.height()
         return hmm/10
 
+    def set_busy_wait(self, dt_s):
+        '''SET_BUSY_WAIT - Wait actively for frame deadlines
+        SET_BUSY_WAIT(dt_s) makes the frame timer fire DT_S seconds before
+        each frame's deadline, after which the display waits actively
+        for the deadline. This gives sub-millisecond precision at the
+        cost of keeping one CPU core busy. Default is zero.'''
+        self.busy_wait_s = dt_s
+
+    def frame_rate(self, stim=None):
+        '''FRAME_RATE - Actual rate of image presentation
+        FRAME_RATE() returns the rate at which images of the current
+        stimulus are presented, in Hertz.
+        FRAME_RATE(stim) returns the rate for the given STIMULUS instead.'''
+        if stim is None:
+            stim = self.stim
+        return stim.f_Hz
+
+    def deadline(self, k):
+        '''DEADLINE - Scheduled time of a frame
+        DEADLINE(k) returns the time, in seconds since the start of the
+        run, at which frame K of the current stimulus is due. DEADLINE(N),
+        where N is the length of the sequence, is the time at which the
+        last frame ends.'''
+        return (self.t_block + self.stim.initial_delay_s
+                + k / self.frame_rate())
+
+    def make_scheduler(self):
+        '''MAKE_SCHEDULER - Construct the scheduler for a run'''
+        return scheduler.Scheduler(self, self.timeout, self.busy_wait_s)
+
     def timeout(self):
         if self.k is None:
             return
-        if self.k<0:
-            # First image
-            self.timer.setInterval(1000 / self.stim.f_Hz)
-            
+        for f in self.followers:
+            f.timeout()
         self.k += 1
         if self.k < self.N:
-            self.pixmap = self.stim.get_image(self.order[self.k])
-            self.update()
+            self.timing.record_fire(self.k, self.scheduler.now())
+            self.scheduler.schedule(self.deadline(self.k + 1))
+            try:
+                entry = self.order[self.k]
+            except ValueError as e:
+                # A streamed order ended before its stated length
+                warnings.warn(f'Run cancelled: {e}')
+                self.finish(cancelled=True)
+                return
+            self.timing.record_image(self.k, entry)
+            imgid = self.stim.original_id(entry)
+            if self.stim.is_composite():
+                self.pixmap = self.stim.compose(entry,
+                                                self.target, self.smooth)
+                if self.k == 0:
+                    self.update()
+                else:
+                    self.update(self.dirty)
+            elif self.k == 0:
+                self.pixmap = self.frame_image(imgid)
+                self.update()
+            elif imgid != self.imgid:
+                self.pixmap = self.frame_image(imgid)
+                # Only the target and the photodiodes change after the
+                # first frame
+                self.update(self.dirty)
+            elif self.photodiodes:
+                # Image is held: only the photodiodes may change
+                self.update(self.pd_region)
+            else:
+                # Nothing to repaint, but the frame still counts
+                self.showgpios()
+                self.notify()
+            self.imgid = imgid
+            ahead = self.k + _DisplayBase.prefetch_frames
+            if ahead < self.N:
+                try:
+                    self.stim.prefetch([self.order[ahead]])
+                except ValueError:
+                    pass # Dealt with when that frame is due
         elif self.k == self.N:
-            for gp in self.gpios:
-                gpio.write(gp.pin, 0)
+            if self.gpios and self.block == len(self.blocks) - 1:
+                gpio.post([gp.pin for gp in self.gpios], [0]*len(self.gpios))
             if self.stim.final_delay_s>0:
                 print('prefinal')
                 self.update()
-                self.timer.setInterval(1000 * self.stim.final_delay_s)
+                self.scheduler.schedule(self.deadline(self.N)
+                                        + self.stim.final_delay_s)
             else:
                 print('final')
-                self.k = None
-                _Display.app.quit()
+                self.end_block()
         else:
-            self.k = None
-            _Display.app.quit()
+            self.end_block()
+
+    def end_block(self):
+        '''END_BLOCK - Move on to the next stimulus in a playlist
+        END_BLOCK() is called when the current stimulus (including its
+        final delay) is over. It starts the next stimulus in the playlist
+        right away, or finishes the run if there is none.'''
+        if self.block >= len(self.blocks) - 1:
+            self.finish()
+            return
+        t = self.deadline(self.N) + self.stim.final_delay_s
+        self.begin_block(self.block + 1, t)
+        self.enter_block()
+
+    def finish(self, cancelled=False):
+        '''FINISH - End the current run
+        FINISH() ends the current run and marks its handle as done.
+        FINISH(cancelled=True) does the same, but also sets the GPIOs to
+        zero and clears the window.'''
+        self.k = None
+        self.scheduler.stop()
+        self.preload.clear()
+        followers = self.followers
+        self.followers = []
+        for f in followers:
+            f.leader = None
+            if f.k is not None:
+                f.finish(cancelled)
+        if len(self.timings) > 1:
+            self.timing = timing.concatenate(self.timings)
+        if cancelled:
+            if self.gpios:
+                gpio.post([gp.pin for gp in self.gpios], [0]*len(self.gpios))
+            self.update()
+        gpio.flush()
+        self.dispatcher.flush()
+        self.dispatcher.report()
+        handle = self.handle
+        self.handle = None
+        if handle is not None:
+            handle._finish(cancelled)
+
+    def last_run_timing(self):
+        '''LAST_RUN_TIMING - Frame timing of the most recent run
+        LAST_RUN_TIMING() returns a RUNTIMING object describing when each
+        frame of the most recent run was scheduled, when its timer fired,
+        and when it was painted, or None if there has not been a run.'''
+        return self.timing
 
     def resizeEvent(self, evt):
         self.target = [0, 0, self.width(), self.height()]
             
-    def run(self, stim, target=None):
-        '''RUN - Show a sequence of stimuli
-        RUN(stim), where STIM is of type STIMULUS, runs through the
-        given stimulus sequence.
-        RUN(stim, target), where TARGET is an (x,y,w,h)-quad, limits
-        the stimulus to the given rectangle, specified in pixels.'''
+    def scaled_image(self, imgid, stim=None, target=None, smooth=None):
+        '''SCALED_IMAGE - Retrieve an image scaled to its size on screen
+        SCALED_IMAGE(id) returns a triplet (img, x, y) where IMG is the
+        image with given ID from the current stimulus, scaled to fit the
+        current target rectangle, and (X, Y) is the position of its
+        top-left corner on the screen.
+        Optional arguments STIM, TARGET, and SMOOTH override the current
+        stimulus, target, and scaling mode.
+        Results are cached by stimulus, image ID, and target geometry (so
+        images that share storage are scaled only once), except for
+        lazily loaded images and images from stacks, which would otherwise
+        all end up in memory. The cache holds at most SCALED_CACHE_MB
+        megabytes; the least recently used images are dropped first.
+        Scaled images keep the compact format of the originals. See
+        SCREEN_IMAGE.'''
+        if stim is None:
+            stim = self.stim
         if target is None:
-            self.target = [0, 0, self.width(), self.height()]
-        else:
-            self.target = target
-        self.show()
-        self.timer = QTimer(self)
-        self.timer.setTimerType(Qt.PreciseTimer)
-        self.timer.timeout.connect(self.timeout)
-        self.time = QTime()
-        self.time.start()
-        self.last_t = 0
-        self.last_k = -1
+            target = self.target
+        if smooth is None:
+            smooth = self.smooth
+        key = (stim, stim.original_id(imgid), tuple(target), smooth)
+        if key in self.scaled:
+            self.scaled.move_to_end(key)
+            return self.scaled[key]
+        res = stim.scale_image(imgid, target, smooth)
+        if stim.in_memory(imgid):
+            self.scaled[key] = res
+            self.scaled_bytes += _image_bytes(res[0])
+            self._trim_scaled()
+        return res
+
+    def screen_image(self, scaled):
+        '''SCREEN_IMAGE - Convert a scaled image to the screen's format
+        SCREEN_IMAGE((img, x, y)) converts a scaled image, as returned by
+        SCALED_IMAGE, to a format that can be painted without further
+        conversion. Images are kept in compact formats until they are
+        about to be shown, so only the current and the next frame are
+        held in the screen's format.'''
+        img, x, y = scaled
+        if isinstance(img, QImage) and img.format() not in _SCREEN_FORMATS:
+            img = img.convertToFormat(QImage.Format_RGB32)
+        return (img, x, y)
+
+    def frame_image(self, imgid):
+        '''FRAME_IMAGE - Scaled and converted image for the current frame
+        FRAME_IMAGE(id) returns the image with the given ID, scaled and
+        converted for the screen, using the work done ahead of time by
+        PREPARE_UPCOMING if possible.'''
+        upcoming = self.upcoming
+        self.upcoming = None
+        if upcoming is not None and upcoming[0]==imgid:
+            return upcoming[1]
+        return self.screen_image(self.scaled_image(imgid))
+
+    def prepare_upcoming(self):
+        '''PREPARE_UPCOMING - Get the next frame's image ready
+        PREPARE_UPCOMING() scales and converts the image of the next
+        frame, if it differs from the current one. This is called right
+        after a frame has been painted, so the work is done while the
+        display waits for the next deadline.'''
+        if self.k is None or self.k + 1 >= self.N:
+            return
+        if self.stim.is_composite():
+            return
+        try:
+            imgid = self.stim.original_id(self.order[self.k + 1])
+        except ValueError:
+            return # Dealt with when that frame is due
+        if imgid == self.imgid:
+            return
+        self.upcoming = (imgid, self.screen_image(self.scaled_image(imgid)))
+
+    def dirty_region(self):
+        '''DIRTY_REGION - Part of the window that changes between frames
+        DIRTY_REGION() returns a QRegion that covers the current target
+        rectangle and all photodiodes. After the first frame of a
+        stimulus, only this region needs to be repainted.'''
+        x, y, w, h = self.target
+        region = QRegion(QRect(int(x), int(y), int(w), int(h)))
+        return region.united(self.photodiode_region())
+
+    def photodiode_region(self):
+        '''PHOTODIODE_REGION - Part of the window covered by photodiodes'''
+        region = QRegion()
+        for pd in self.photodiodes:
+            x, y, w, h = pd.rect
+            region = region.united(QRect(x, y, w, h))
+        return region
+
+    def preload_some(self):
+        '''PRELOAD_SOME - Pre-scale images of the next stimulus in a playlist
+        PRELOAD_SOME() scales as many images of the next stimulus as
+        can be done before the next frame is due.'''
+        while self.preload and self.k is not None:
+            left = self.deadline(self.k + 1) - self.scheduler.now()
+            if left < 2 * self.scale_cost + 0.002:
+                break
+            t0 = time.perf_counter()
+            self.scaled_image(*self.preload.popleft())
+            dt = time.perf_counter() - t0
+            self.scale_cost = max(dt, 0.9 * self.scale_cost)
+
+    def begin_block(self, b, t):
+        '''BEGIN_BLOCK - Get ready to show one stimulus of a playlist
+        BEGIN_BLOCK(b, t) makes stimulus B of the current playlist the
+        current stimulus, starting at time T, and queues the images of
+        stimulus B+1 for pre-scaling.'''
+        stim, target, smooth = self.blocks[b]
+        if target is None:
+            target = [0, 0, self.width(), self.height()]
+        self.block = b
+        self.t_block = t
         self.stim = stim
+        self.target = target
+        self.smooth = smooth
+        self.order = stim.presentation_order(self.frame_rate())
+        self.last_k = -1
         self.pixmap = None
-        self.order = stim.presentation_order()
+        self.imgid = None
+        self.upcoming = None
         self.N = len(self.order)
+        # State of every photodiode and GPIO in every frame
+        self.syncplan = sync.plan(self.N, self.photodiodes + self.gpios)
+        self.dirty = self.dirty_region()
+        self.pd_region = self.photodiode_region()
+        self.timing = timing.RunTiming(self.order, self.frame_rate(),
+                                       self.deadline(0), self.syncplan, b)
+        self.timings.append(self.timing)
+        self.stim.prefetch(_lookahead(self.order))
         self.k = -1
-        self.pdphases = []
-        for pd in self.photodiodes:
-            self.pdphases.append(pd.period - pd.delay)
-        self.gpphases = []
-        for gp in self.gpios:
-            self.gpphases.append(gp.period - gp.delay)
-            
+
+        self.preload.clear()
+        if b + 1 < len(self.blocks):
+            stim1, target1, smooth1 = self.blocks[b + 1]
+            if target1 is None:
+                target1 = [0, 0, self.width(), self.height()]
+            order1 = stim1.presentation_order(self.frame_rate(stim1))
+            for imgid in _used_images(stim1, order1):
+                if stim1.in_memory(imgid):
+                    self.preload.append((imgid, stim1, target1, smooth1))
+            stim1.prefetch(_lookahead(order1))
+
+    def enter_block(self):
+        '''ENTER_BLOCK - Start showing the current stimulus'''
         if self.stim.initial_delay_s>0:
-            self.timer.setInterval(self.stim.initial_delay_s * 1000)
+            self.update()
+            self.scheduler.schedule(self.deadline(0))
         else:
             self.timeout()
-        self.timer.start()
 
+    def prepare_playlist(self, blocks):
+        '''PREPARE_PLAYLIST - Get ready to show a playlist
+        PREPARE_PLAYLIST(blocks), where BLOCKS is a list of (stim, target,
+        smooth) triplets, does all the work of RUN_PLAYLIST except actually
+        starting: it pre-scales images of the first stimulus, and sets up
+        the scheduler and the timing record.'''
+        self.blocks = list(blocks)
+        stims = set(b[0] for b in self.blocks)
+        for key in list(self.scaled):
+            if key[0] not in stims:
+                self.scaled_bytes -= _image_bytes(self.scaled.pop(key)[0])
+        self.timings = []
+        self.dispatcher.reset()
+        self.begin_block(0, 0)
+        for imgid in _used_images(self.stim, self.order):
+            if self.scaled_bytes >= self.scaled_limit:
+                break # No point scaling images that would be dropped again
+            if self.stim.in_memory(imgid):
+                self.scaled_image(imgid)
+        self.show()
+        if self.leader is None:
+            self.scheduler = self.make_scheduler()
+        else:
+            self.scheduler = scheduler.FollowerScheduler(self.leader)
+        self.last_t = 0
+
+    def prepare(self, stim, target=None, smooth=False):
+        '''PREPARE - Get ready to show a sequence of stimuli
+        PREPARE(stim, target, smooth) does all the work of RUN except
+        actually starting the sequence: it pre-scales images, computes
+        the sync plan, and sets up the scheduler and the timing record.'''
+        self.prepare_playlist([(stim, target, smooth)])
 
-        if True:
-            _Display.app.exec()
-            
-        self.timer.stop()
-        del self.timer
+    def start_playlist(self, blocks):
+        '''START_PLAYLIST - Start showing a playlist
+        handle = START_PLAYLIST(blocks), where BLOCKS is a list of
+        (stim, target, smooth) triplets, starts showing the stimuli one
+        after the other and returns immediately with a RUNHANDLE.'''
+        if self.handle is not None:
+            raise RuntimeError('Display is already running a sequence')
+        self.prepare_playlist(blocks)
+        self.handle = RunHandle(self)
+        handle = self.handle
+        self.scheduler.start()
+        self.enter_block()
+        return handle
+
+    def start(self, stim, target=None, smooth=False):
+        '''START - Start showing a sequence of stimuli
+        handle = START(stim, target, smooth) is like RUN, except that it
+        returns immediately with a RUNHANDLE.'''
+        return self.start_playlist([(stim, target, smooth)])
+
+    def run(self, stim, target=None, smooth=False):
+        '''RUN - Show a sequence of stimuli
+        RUN(stim), where STIM is of type STIMULUS, runs through the
+        given stimulus sequence.
+        RUN(stim, target), where TARGET is an (x,y,w,h)-quad, limits
+        the stimulus to the given rectangle, specified in pixels.
+        Optional argument SMOOTH selects smooth rather than nearest-
+        neighbor scaling.'''
+        self.start(stim, target, smooth).wait()
 
     def paintEvent(self, evt):
-        ww = self.target[2]
-        wh = self.target[3]
         p = QPainter(self)
+        size = (self.width(), self.height())
         if self.stim is None:
             rgb = [0,0,0]
         else:
             rgb = self.stim.background
-        p.fillRect(QRect(0,0,self.width(),self.height()),
-                   QColor(rgb[0], rgb[1], rgb[2]))
+        if evt is None:
+            region = None
+        else:
+            region = evt.region()
         if self.k is None or self.k<0 or self.k>=self.N:
-            if self.k is None:
-                _Display.app.quit()
+            render.paint_frame(p, size, rgb, region=region)
             return
-        iw = self.pixmap.width() # image size (pix)
-        ih = self.pixmap.height()
-        if iw>0 and ih>0:
-            rx = ww/iw # ratio
-            ry = wh/ih
-            rat = min(rx, ry)
-            sw = iw*rat # actual size of image on screen
-            sh = ih*rat
-            x0 = self.target[0] + (ww-sw)//2 # margin
-            y0 = self.target[1] + (wh-sh)//2
-            p.drawPixmap(QRect(x0, y0, sw, sh), self.pixmap)
-        self.showphotodiodes(p)
-        self.showgpios()
+        render.paint_frame(p, size, rgb, self.pixmap,
+                           self.photodiodes, self.syncplan[self.k], region)
                 
         if self.k != self.last_k:
+            self.showgpios()
             self.notify()
 
     def showgpios(self):
         if len(self.gpios)==0:
             return
-        for n in range(len(self.gpios)):
-            gp = self.gpios[n]
-            pin = gp.pin
-            if self.gpphases[n]>=gp.period:
-                val = 1
-                self.gpphases[n] = 1
-            else:
-                val = 0
-                self.gpphases[n] += 1
-            gpio.write(pin, val)
-
-    def showphotodiodes(self, p):
-        for n in range(len(self.photodiodes)):
-            pd = self.photodiodes[n]
-            x,y,w,h = pd.rect
-            if self.pdphases[n]>=pd.period:
-                col = QColor(255,255,255)
-                self.pdphases[n] = 1
-            else:
-                col = QColor(0,0,0)
-                self.pdphases[n] += 1
-            p.fillRect(QRect(x,y,w,h), col)
-        
+        on = self.syncplan[self.k, len(self.photodiodes):]
+        pins = [gp.pin for gp in self.gpios]
+        gpio.post(pins, on.astype(int).tolist()) # Written by a background thread
 
     def notify(self):
-        t = self.time.elapsed()/1000
+        t = self.scheduler.now()
+        self.timing.record_paint(self.k, t)
         dt = t - self.last_t
-        fn = self.stim.fns[self.order[self.k]]
-        #print(f'Showing image {self.k} ({fn}) at {t:.3f} (delta={dt:.3f})')
+        #print(f'Showing frame {self.k} at {t:.3f} (delta={dt:.3f})')
         self.last_t = t
         self.last_k = self.k
-        for cb in self.callbacks:
-            cb(self.k, t)
+        self.dispatcher.notify(self.k, t)
+        QTimer.singleShot(0, self.prepare_upcoming)
+        if self.preload:
+            QTimer.singleShot(0, self.preload_some)
+
+# Formats that Qt paints without conversion
+_SCREEN_FORMATS = (QImage.Format_RGB32, QImage.Format_ARGB32_Premultiplied)
+
+
+def _image_bytes(img):
+    if img is None:
+        return 0
+    if isinstance(img, QImage):
+        return img.sizeInBytes()
+    return img.width() * img.height() * img.depth() // 8
+
+
+def _lookahead(order):
+    # The first few entries of an order. A stream that ends within
+    # these is dealt with when the missing frame is due.
+    try:
+        return order[:_DisplayBase.prefetch_frames]
+    except ValueError:
+        return order.realized()[:_DisplayBase.prefetch_frames].tolist()
+
+
+def _used_images(stim, order):
+    # A streamed order is only read as far as the prefetch window, so
+    # that we do not force the whole stream into memory
+    if isinstance(order, orders.Stream):
+        order = _lookahead(order)
+    return set(stim.original_id(k) for k in orders.distinct(order))
+
+
+class _Display(_DisplayBase, QWidget):
+    pass
+
+
+class DisplayGroup:
+    def __init__(self, screen_numbers=(0, 1), full_screen=True,
+                 vsync=False, software_gl=False):
+        '''DISPLAYGROUP - Several screens showing stimuli in lockstep
+        DISPLAYGROUP() creates a full-screen display window on each of
+        the first two monitors, for showing a separate stimulus on each
+        (e.g., for binocular or dichoptic experiments). A single scheduler
+        drives all screens, so that each frame is issued to all screens
+        in the same tick.
+        Optional argument SCREEN_NUMBERS specifies which monitors to use.
+        The first is the leader: its clock times the run, and it owns
+        the GPIOs and callbacks.
+        Optional arguments FULL_SCREEN, VSYNC, and SOFTWARE_GL are as for
+        DISPLAY and apply to all screens.
+        The DISPLAYS member holds a DISPLAY for each screen, which may be
+        used for geometry calculations.'''
+        self.displays = [Display(n, full_screen, vsync, software_gl)
+                         for n in screen_numbers]
+        self.handle = None
+
+    def add_gpio(self, pin, period=2, delay=0):
+        '''ADD_GPIO - Add a GPIO synchronization signal
+        ADD_GPIO(pin, period, delay) is as DISPLAY.ADD_GPIO. The signal
+        follows the frames of all screens.'''
+        self.displays[0].add_gpio(pin, period, delay)
+
+    def add_photodiode(self, rect, period=2, delay=0, screen=0):
+        '''ADD_PHOTODIODE - Add a photodiode synchronization square
+        ADD_PHOTODIODE(rect, period, delay) is as DISPLAY.ADD_PHOTODIODE,
+        for the first screen.
+        Optional argument SCREEN specifies the screen (counting from zero
+        in the order of SCREEN_NUMBERS) on which to show the square.'''
+        self.displays[screen].add_photodiode(rect, period, delay)
+
+    def add_callback(self, cb, critical=False):
+        '''ADD_CALLBACK - Add a function to be called at every frame
+        ADD_CALLBACK(cb, critical) is as DISPLAY.ADD_CALLBACK. Callbacks
+        are called when the first screen has been painted.'''
+        self.displays[0].add_callback(cb, critical)
+
+    def set_busy_wait(self, dt_s):
+        '''SET_BUSY_WAIT - Wait actively for frame deadlines
+        SET_BUSY_WAIT(dt_s) is as DISPLAY.SET_BUSY_WAIT.'''
+        self.displays[0].set_busy_wait(dt_s)
+
+    def run(self, stims, targets=None, smooth=False):
+        '''RUN - Show stimulus sequences on all screens
+        RUN(stims), where STIMS is a list with a STIMULUS for each screen,
+        shows each stimulus on its screen, frame by frame in lockstep.
+        All stimuli must have the same number of frames, refresh rate,
+        and initial and final delays.
+        Optional argument TARGETS is a list with a target rectangle for
+        each screen (or None for the whole screen), as for DISPLAY.RUN.
+        Optional argument SMOOTH is as for DISPLAY.RUN.'''
+        self.run_async(stims, targets, smooth).wait()
+
+    def run_async(self, stims, targets=None, smooth=False):
+        '''RUN_ASYNC - Start showing stimulus sequences on all screens
+        handle = RUN_ASYNC(stims, targets, smooth) is to RUN as
+        DISPLAY.RUN_ASYNC is to DISPLAY.RUN.'''
+        if len(stims) != len(self.displays):
+            raise ValueError('Must have one stimulus for each screen')
+        if targets is None:
+            targets = [None] * len(stims)
+        s0 = stims[0]
+        rate = self.displays[0]._disp.frame_rate(s0)
+        N = len(s0.presentation_order(rate))
+        for disp, stim in zip(self.displays[1:], stims[1:]):
+            rate = disp._disp.frame_rate(stim)
+            if len(stim.presentation_order(rate)) != N:
+                raise ValueError('All stimuli must have the same length')
+            if (stim.f_Hz != s0.f_Hz
+                    or stim.initial_delay_s != s0.initial_delay_s
+                    or stim.final_delay_s != s0.final_delay_s):
+                raise ValueError('All stimuli must have the same timing')
+        leader = self.displays[0]._disp
+        followers = [disp._disp for disp in self.displays[1:]]
+        if leader.handle is not None:
+            raise RuntimeError('Display is already running a sequence')
+        for f, stim, target in zip(followers, stims[1:], targets[1:]):
+            f.leader = leader
+            f.prepare(stim, target, smooth)
+        leader.followers = followers
+        self.handle = leader.start(stims[0], targets[0], smooth)
+        return self.handle
+
+    def last_run_timing(self):
+        '''LAST_RUN_TIMING - Frame timing of the most recent run
+        t = LAST_RUN_TIMING() returns a single RUNTIMING for all screens,
+        as combined by TIMING.COMBINE: a frame counts as shown when it
+        has been painted on all screens. T.SCREENS holds the timing of
+        each screen separately.'''
+        timings = [disp.last_run_timing() for disp in self.displays]
+        if any(t is None for t in timings):
+            return None
+        return timing.combine(timings)
+
+    def close(self):
+        '''CLOSE - Close all display windows'''
+        for disp in self.displays:
+            disp.close()
+
+
+def process_events(timeout_s=None):
+    '''PROCESS_EVENTS - Let Qt process pending events
+    PROCESS_EVENTS() processes pending Qt events without waiting.
+    PROCESS_EVENTS(timeout_s) waits for events for at most the given
+    time, in seconds, and processes them. Runs started with RUN_ASYNC
+    only make progress while Qt events are being processed.'''
+    app = _DisplayBase.app
+    if timeout_s is None:
+        app.processEvents()
+    else:
+        wakeup = QTimer()
+        wakeup.setSingleShot(True)
+        wakeup.start(max(0, round(1000 * timeout_s)))
+        app.processEvents(QEventLoop.AllEvents | QEventLoop.WaitForMoreEvents)
+        wakeup.stop()
+
+
+async def pump_events(interval_s=0.001):
+    '''PUMP_EVENTS - Process Qt events from an asyncio event loop
+    PUMP_EVENTS() is a coroutine that keeps processing Qt events every
+    INTERVAL_S seconds (default: 1 ms) until it is cancelled. Run it
+    as an asyncio task to keep the display responsive while asyncio
+    code runs. Awaiting a RUNHANDLE does this automatically.'''
+    while True:
+        process_events()
+        await asyncio.sleep(interval_s)
+
+
+class RunHandle:
+    '''Class RUNHANDLE: A stimulus sequence that is being shown
+    A RUNHANDLE is returned by DISPLAY.RUN_ASYNC. It behaves much like
+    a concurrent.futures.Future: 
+      - DONE - Whether the run has ended
+      - CANCEL - Stop the run early
+      - CANCELLED - Whether the run was cancelled
+      - WAIT - Wait for the run to end
+      - RESULT - Wait for the run to end and return its timing record
+      - ADD_DONE_CALLBACK - Arrange for a function to be called at the end
+    In an asyncio coroutine, a RUNHANDLE can also be awaited, which
+    yields the timing record.
+    Qt timers only fire while Qt processes events. WAIT and RESULT do
+    that for you, as does awaiting the handle. Otherwise, call
+    PROCESS_EVENTS regularly.'''
+    def __init__(self, disp):
+        self._disp = disp
+        self._done = False
+        self._cancelled = False
+        self._callbacks = []
+        self.timing = None
+
+    def done(self):
+        '''DONE - Whether the run has ended (or was cancelled)'''
+        return self._done
+
+    def cancelled(self):
+        '''CANCELLED - Whether the run was cancelled'''
+        return self._cancelled
+
+    def cancel(self):
+        '''CANCEL - Stop the run early
+        CANCEL() stops the run, clears the window, and returns True,
+        unless the run had already ended, in which case it returns False.'''
+        if self._done:
+            return False
+        self._disp.finish(cancelled=True)
+        return True
+
+    def wait(self, timeout=None):
+        '''WAIT - Wait for the run to end
+        WAIT() processes Qt events until the run has ended.
+        WAIT(timeout) gives up after the given time, in seconds.
+        Returns True if the run has ended.'''
+        if timeout is not None:
+            t_end = time.perf_counter() + timeout
+        while not self._done:
+            if timeout is None:
+                _DisplayBase.app.processEvents(QEventLoop.AllEvents
+                                               | QEventLoop.WaitForMoreEvents)
+            else:
+                dt = t_end - time.perf_counter()
+                if dt <= 0:
+                    break
+                process_events(dt)
+        return self._done
+
+    def result(self, timeout=None):
+        '''RESULT - Wait for the run to end and return its timing record
+        RESULT() waits for the run to end (see WAIT) and returns a
+        RUNTIMING, as DISPLAY.LAST_RUN_TIMING would.
+        Raises concurrent.futures.TimeoutError if the run has not ended
+        within TIMEOUT seconds, or concurrent.futures.CancelledError if
+        the run was cancelled.'''
+        if not self.wait(timeout):
+            raise concurrent.futures.TimeoutError()
+        if self._cancelled:
+            raise concurrent.futures.CancelledError()
+        return self.timing
+
+    def add_done_callback(self, fn):
+        '''ADD_DONE_CALLBACK - Arrange for a function to be called at the end
+        ADD_DONE_CALLBACK(fn) causes FN to be called with the handle as
+        its argument when the run ends. If it has already ended, FN is
+        called immediately.'''
+        if self._done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def __await__(self):
+        while not self._done:
+            process_events()
+            yield from asyncio.sleep(0.001).__await__()
+        return self.result()
+
+    def _finish(self, cancelled):
+        self.timing = self._disp.timing
+        self._cancelled = cancelled
+        self._done = True
+        for fn in self._callbacks:
+            fn(self)
+
+
+class _GLDisplay(_DisplayBase, QOpenGLWidget):
+    '''_GLDISPLAY - Canvas for displaying images in sync with the monitor
+    This is an OpenGL-backed version of _DISPLAY that swaps buffers in
+    sync with the vertical refresh of the monitor. Images are advanced
+    by counting buffer swaps rather than by a timer, so each image is
+    held for a whole number of refreshes.'''
+    painted = False
+    painted_k = None
+    unswapped = None
+    idle_swaps = 0 # Swaps since the current frame should have been drawn
+
+    def __init__(self, screen_number=0, full_screen=True, software=False):
+        if software:
+            # Mesa software rendering, for machines without a GPU
+            os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+            if QApplication.instance() is None:
+                QApplication.setAttribute(Qt.AA_UseSoftwareOpenGL)
+        fmt = QSurfaceFormat.defaultFormat()
+        fmt.setSwapInterval(1)
+        QSurfaceFormat.setDefaultFormat(fmt)
+        super(_GLDisplay, self).__init__(screen_number, full_screen)
+        if not self.isValid():
+            raise ValueError('Could not create an OpenGL context')
+        self.setUpdateBehavior(QOpenGLWidget.PartialUpdate)
+        self.frameSwapped.connect(self.swapped)
+
+    def refresh_rate(self):
+        '''REFRESH_RATE - Refresh rate of the monitor, in Hertz'''
+        return self.windowHandle().screen().refreshRate()
+
+    def frames_per_image(self, stim=None):
+        '''FRAMES_PER_IMAGE - Number of refreshes that each image is held'''
+        if stim is None:
+            stim = self.stim
+        return max(1, round(self.refresh_rate() / stim.f_Hz))
+
+    def frame_rate(self, stim=None):
+        return self.refresh_rate() / self.frames_per_image(stim)
+
+    def deadline(self, k):
+        # Round the initial delay to a whole number of refreshes
+        f = self.refresh_rate()
+        return self.t_block + (round(self.stim.initial_delay_s * f)
+                               + k * self.frames_per_image()) / f
+
+    def make_scheduler(self):
+        return scheduler.SwapScheduler(self, self.timeout,
+                                       self.refresh_rate())
+
+    def resizeGL(self, w, h):
+        self.painted = False
+
+    def paintGL(self):
+        # Because of PartialUpdate, the framebuffer keeps its contents
+        # if we do not paint, so we only paint when the frame changes.
+        if self.painted and self.k == self.painted_k:
+            return
+        self.painted = True
+        self.painted_k = self.k
+        if self.k is not None and self.k >= 0 and self.k < self.N:
+            self.unswapped = self.k
+        _DisplayBase.paintEvent(self, None)
+
+    def paintEvent(self, evt):
+        QOpenGLWidget.paintEvent(self, evt)
+
+    def swapped(self):
+        if self.unswapped is not None and self.timing is not None:
+            self.timing.record_swap(self.unswapped, self.scheduler.now())
+            self.unswapped = None
+        if not hasattr(self, 'scheduler'):
+            return
+        if (self.leader is None and self.k is not None
+                and 0 <= self.k < self.N and self.painted_k != self.k):
+            # The buffer was swapped without the current frame having
+            # been drawn. Such a swap must not count as showing it.
+            self.idle_swaps += 1
+            if self.idle_swaps > self.refresh_rate():
+                warnings.warn('Run cancelled: OpenGL window is not painted')
+                self.finish(cancelled=True)
+            else:
+                self.update()
+            return
+        self.idle_swaps = 0
+        self.scheduler.swapped()
+
 
 class Display:
-    def __init__(self, screen_number=0, full_screen=True):
+    def __init__(self, screen_number=0, full_screen=True,
+                 vsync=False, software_gl=False):
         '''DISPLAY - Canvas for displaying images
         DISPLAY() creates a full-screen display window.
         Optional argument SCREEN_NUMBER specifies the number of the monitor
         on which to display (counting from zero).
-        DISPLAY(full_screen=False) creates a smaller window for testing.'''
-        self._disp = _Display(screen_number, full_screen)
+        DISPLAY(full_screen=False) creates a smaller window for testing.
+        DISPLAY(vsync=True) creates an OpenGL-backed window that changes
+        images only at the monitor's vertical refresh, which avoids
+        tearing. Each image is then held for a whole number of refreshes,
+        so the actual frame rate is the refresh rate divided by an
+        integer, as close as possible to the requested rate. The times
+        at which frames actually reached the screen are reported in
+        the SWAPPED field of LAST_RUN_TIMING.
+        Optional argument SOFTWARE_GL selects Mesa software rendering
+        for the OpenGL window, for testing on machines without a GPU.
+        If no OpenGL context can be created, an exception is raised.'''
+        if vsync:
+            self._disp = _GLDisplay(screen_number, full_screen, software_gl)
+        else:
+            self._disp = _Display(screen_number, full_screen)
+
+    def startup_time(self):
+        '''STARTUP_TIME - Time it took to construct the display
+        t = STARTUP_TIME() returns the time, in seconds, from the start
+        of construction until the window was first painted black. This
+        includes the creation of the Qt application, if needed.'''
+        return self._disp.startup_s
+
+    def reset(self):
+        '''RESET - Prepare the display for a new session
+        RESET() removes all photodiodes, GPIOs, and callbacks, restores
+        the default callback mode, and forgets cached images and the
+        timing of the last run. The window itself stays up, so this is
+        much faster than constructing a new DISPLAY. Any GPIOs are set
+        to zero first, and a run in progress is cancelled.
+        See also GET_DISPLAY.'''
+        self._disp.reset()
 
     def add_gpio(self, pin, period=2, delay=0):
         '''ADD_GPIO - Add a GPIO signal
@@ -314,12 +1060,63 @@ class Display:
         be in the given frame (counted from zero) rather than in frame 0.'''
         self._disp.add_photodiode(rect, period, delay)
 
-    def add_callback(self, cb):
+    def add_callback(self, cb, critical=False):
         '''ADD_CALLBACK - Add a function to be called at start of frame
         ADD_CALLBACK(func) causes the given function to be called at
         the start of every frame, with the frame number and the current
-        time (in seconds) as arguments.'''
-        self._disp.add_callback(cb)
+        time (in seconds) as arguments.
+        By default, callbacks are called from the paint routine, so a
+        slow callback delays the frame. See SET_CALLBACK_MODE to avoid
+        that.
+        ADD_CALLBACK(func, critical=True) adds a critical callback, which
+        is always called from the paint routine, and whose duration can
+        be checked (see SET_CRITICAL_BUDGET). Use this only for quick
+        functions that must run in sync with the frame.'''
+        self._disp.add_callback(cb, critical)
+
+    def set_callback_mode(self, mode):
+        '''SET_CALLBACK_MODE - Specify how callbacks are called
+        SET_CALLBACK_MODE('inline') causes callbacks to be called directly
+        from the paint routine. This is the default.
+        SET_CALLBACK_MODE('thread') causes callbacks that are not critical
+        to be called from a worker thread instead. The paint routine then
+        only timestamps the frame and queues the frame number and time
+        for the worker, so that slow callbacks (writing to disk, sending
+        network triggers) do not delay frames. RUN waits for the worker
+        to handle all frames before returning.'''
+        self._disp.set_callback_mode(mode)
+
+    def set_critical_budget(self, dt_s):
+        '''SET_CRITICAL_BUDGET - Time budget for critical callbacks
+        SET_CRITICAL_BUDGET(dt_s) causes frames in which the critical
+        callbacks together take longer than DT_S seconds to be counted.
+        A single warning is issued at the end of a run in which that
+        happened; see CRITICAL_OVERRUNS for the details.
+        SET_CRITICAL_BUDGET(None) disables the check.'''
+        self._disp.set_critical_budget(dt_s)
+
+    def critical_overruns(self):
+        '''CRITICAL_OVERRUNS - Budget overruns of critical callbacks
+        (n, worst_s) = CRITICAL_OVERRUNS() returns the number of frames of
+        the most recent run in which the critical callbacks exceeded the
+        budget set by SET_CRITICAL_BUDGET, and the longest time, in
+        seconds, that they took in any frame of that run.'''
+        return self._disp.critical_overruns()
+
+    def set_scaled_cache(self, mb):
+        '''SET_SCALED_CACHE - Limit the memory used by pre-scaled images
+        SET_SCALED_CACHE(mb) limits the memory that the display uses to
+        keep images scaled to their on-screen size between frames and
+        runs. Default is 256 MB. Images beyond that are scaled again
+        when they are next shown, which costs time while painting.'''
+        self._disp.set_scaled_cache(mb)
+
+    def memory_usage(self):
+        '''MEMORY_USAGE - Memory used by pre-scaled images
+        MEMORY_USAGE() returns the number of bytes used by the images that
+        the display keeps scaled to their on-screen size. This comes on
+        top of STIMULUS.MEMORY_USAGE, and is limited by SET_SCALED_CACHE.'''
+        return self._disp.memory_usage()
 
     def width_pixels(self):
         '''WIDTH_PIXELS - Width of the window in pixels
@@ -352,17 +1149,8 @@ class Display:
         return self._disp.height_cm()
 
     def find_pixel_static(xy, wh, WH):
-        iw, ih = wh  # image width, height
-
+        x0, y0, sw, sh, rat = geometry.fit(wh, (0, 0, WH[0], WH[1]))
         ix, iy = xy  # point of interest in image coords
-        ww, hh = WH
-        rx = ww / iw
-        ry = hh / ih
-        rat = min(rx, ry)  # effective scale of image on screen
-        sw = iw * rat  # screen width of image
-        sh = ih * rat
-        x0 = ww / 2 - sw / 2  # screen position of top left of image
-        y0 = hh / 2 - sh / 2
         x = x0 + ix * rat
         y = y0 + iy * rat
         return x, y
@@ -388,38 +1176,135 @@ class Display:
         mode, the calculation is as if the output is going to be scaled to the
         full screen in post.'''
 
-        sw_pix = self.width_pixels()
-        #sh_pix = self.height_pixels()
-        sw_cm = self.width_cm()
-        #sh_cm = self.height_cm()
-        iw_cm = np.tan(theta * np.pi / 180) * screendist_cm
-        iw_pix = int(sw_pix * iw_cm / sw_cm)
-        return iw_pix
+        geom = self.screen_geometry(screendist_cm)
+        npix = np.asarray(geom.angle_to_pixels(theta)).astype(int)
+        if npix.ndim==0:
+            return int(npix)
+        return npix
 
     def pixel_to_angle(self, npix, screendist_cm):
         '''PIXEL_TO_ANGLE - Inverse of ANGLE_TO_PIXEL'''
-        sw_pix = self.width_pixels()
-        # sh_pix = self.height_pixels()
-        sw_cm = self.width_cm()
-        # sh_cm = self.height_cm()
-        iw_pix = npix
-        iw_cm = iw_pix * sw_cm / sw_pix
-        theta = (180 / np.pi) * np.atan(iw_cm/screendist_cm)
-        return theta
-
-    def run(self, stim, target=None):
+        return self.screen_geometry(screendist_cm).pixels_to_angle(npix)
+
+    def screen_geometry(self, screendist_cm=None, target=None, center=None):
+        '''SCREEN_GEOMETRY - Capture the geometry of the display
+        geom = SCREEN_GEOMETRY() returns a GEOMETRY.SCREENGEOMETRY that
+        maps between image pixels, screen pixels, and visual angles for
+        the current window size and screen, without querying the screen
+        again for every conversion. Use it to convert many points at
+        once.
+        Optional argument SCREENDIST_CM specifies the distance between
+        the eye and the screen, needed for visual angles.
+        Optional argument TARGET specifies the target rectangle, as for
+        RUN.
+        Optional argument CENTER specifies the screen position straight
+        ahead of the eye. Default is the center of the window.
+        Pixel sizes are calibrated separately for width and height. As
+        for ANGLE_TO_PIXEL, a window that is not full screen is treated
+        as if it will be scaled to the full screen.'''
+        wh = (self.width_pixels(), self.height_pixels())
+        cm_per_pixel = (self.width_cm() / wh[0], self.height_cm() / wh[1])
+        return geometry.ScreenGeometry(wh, cm_per_pixel, screendist_cm,
+                                       target, center)
+
+    def set_busy_wait(self, dt_s):
+        '''SET_BUSY_WAIT - Wait actively for frame deadlines
+        SET_BUSY_WAIT(dt_s) makes the frame timer fire DT_S seconds before
+        each frame's deadline, after which the display waits actively
+        for the deadline. Qt timers have only millisecond precision, so
+        a value of 0.002 or so gives much more precise frame timing, at
+        the cost of keeping one CPU core busy. Default is zero.'''
+        self._disp.set_busy_wait(dt_s)
+
+    def run(self, stim, target=None, smooth=False):
         '''RUN - Show a sequence of stimuli
         RUN(stim), where STIM is of type STIMULUS, runs through the
         given stimulus sequence.
         RUN(stim, target), where TARGET is an (x,y,w,h)-quad, limits
         the stimulus to the given rectangle, specified in pixels.
+        Frame K is scheduled at an absolute time of K/f_Hz seconds
+        after the initial delay, so that timing errors do not accumulate
+        and the total duration of a sequence of N images is always N/f_Hz.
         Images from the stimulus sequence are always scaled (up or down)
         to optimally fit in the target rectangle, possibly leaving
         bands of background color along top and bottom, or along left and
-        right edges.
+        right edges. Scaling is done once for each image before the
+        sequence starts. By default, nearest-neighbor scaling is used,
+        which keeps the pixels of low-resolution images sharp.
+        Optional argument SMOOTH selects smooth scaling instead, which
+        is better for photographs.
         '''
-        self._disp.run(stim, target)
+        self._disp.run(stim, target, smooth)
         
+    def run_async(self, stim, target=None, smooth=False):
+        '''RUN_ASYNC - Start showing a sequence of stimuli
+        handle = RUN_ASYNC(stim, target, smooth) starts showing a stimulus
+        sequence like RUN, but returns immediately with a RUNHANDLE that
+        can be polled (HANDLE.DONE()), waited for (HANDLE.WAIT() or
+        HANDLE.RESULT()), cancelled (HANDLE.CANCEL()), or awaited from
+        an asyncio coroutine:
+
+            timing = await disp.run_async(stim)
+
+        The sequence only makes progress while Qt events are processed.
+        Waiting for or awaiting the handle takes care of that. Otherwise,
+        call PROCESS_EVENTS regularly, or run PUMP_EVENTS as an asyncio
+        task. Work done in between should be kept short, lest it delay
+        frames.'''
+        return self._disp.start(stim, target, smooth)
+
+    def run_playlist(self, playlist):
+        '''RUN_PLAYLIST - Show several sequences of stimuli back to back
+        RUN_PLAYLIST(playlist), where PLAYLIST is of type PLAYLIST, shows
+        each of its stimulus sequences in turn, in a single session.
+        Each sequence follows the previous one (including its final delay)
+        without any gap, and the images of the next sequence are prepared
+        while the current one is playing.
+        LAST_RUN_TIMING then reports all frames of all sequences, with
+        the position of the sequence in the playlist in the BLOCK field.'''
+        self._disp.start_playlist(playlist.blocks).wait()
+
+    def run_playlist_async(self, playlist):
+        '''RUN_PLAYLIST_ASYNC - Start showing a playlist
+        handle = RUN_PLAYLIST_ASYNC(playlist) is to RUN_PLAYLIST as
+        RUN_ASYNC is to RUN.'''
+        return self._disp.start_playlist(playlist.blocks)
+
+    def render(self, stim, target=None, smooth=False, out=None, workers=None):
+        '''RENDER - Render a stimulus sequence offline
+        frames = RENDER(stim) renders every frame of the stimulus sequence
+        STIM exactly as RUN(stim) would show it in this display window,
+        including background and photodiodes, but without timers and
+        without showing anything. The result is an NxHxWx3 uint8 array.
+        Optional arguments TARGET and SMOOTH are as for RUN.
+        Optional argument OUT streams the frames to a file: a memory-
+        mapped .npy file if OUT ends in ".npy", or raw RGB24 video
+        otherwise. See RENDER.RENDER for details.
+        Optional argument WORKERS specifies the number of threads used
+        for rendering.'''
+        return render.render(stim, (self.width_pixels(), self.height_pixels()),
+                             target, smooth, self._disp.photodiodes,
+                             out, workers)
+
+    def last_run_timing(self):
+        '''LAST_RUN_TIMING - Frame timing of the most recent run
+        t = LAST_RUN_TIMING() returns a RUNTIMING object (see the TIMING
+        module) describing the most recent run. T.FRAMES is a numpy
+        array with one record per frame holding the scheduled time,
+        the time the frame timer fired, the time the frame was painted,
+        the image ID, and the state of the photodiodes and GPIOs. All
+        times are in seconds since the start of the run, measured with
+        a high-resolution monotonic clock.
+        T.SUMMARY() returns summary statistics, and T.DROPPED() lists
+        frames that missed their deadline.
+        T.SYNC_PLAN is an NxS boolean array with the state of each
+        photodiode (in order of ADD_PHOTODIODE) and then each GPIO
+        (in order of ADD_GPIO) in each frame. This is computed before
+        the run starts, so that the signals always follow the frame
+        numbers, even if the window is repainted for other reasons.
+        T.SAVE(filename) saves all this for offline analysis.'''
+        return self._disp.last_run_timing()
+
     def close(self):
         '''CLOSE - Close the display window
         CLOSE() closes the display window. This is not what you normally
@@ -428,3 +1313,25 @@ class Display:
         window without crashing the software.'''
         self._disp.hide()
         
+
+
+_displays = {} # Displays constructed by GET_DISPLAY, by their arguments
+
+
+def get_display(screen_number=0, full_screen=True,
+                vsync=False, software_gl=False):
+    '''GET_DISPLAY - Reuse a display across sessions
+    disp = GET_DISPLAY() returns a full-screen DISPLAY, constructing it
+    only the first time. Later calls with the same arguments return the
+    same DISPLAY after calling its RESET method, so that scripts that
+    run many sessions in one process do not pay for constructing a
+    window each time. A DISPLAY that has been closed is replaced.
+    Arguments are as for DISPLAY.'''
+    key = (screen_number, full_screen, vsync, software_gl)
+    disp = _displays.get(key)
+    if disp is None or not disp._disp.isVisible():
+        disp = Display(screen_number, full_screen, vsync, software_gl)
+        _displays[key] = disp
+    else:
+        disp.reset()
+    return disp
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+def fit(wh, target):
+    '''FIT - Placement of an image in a target rectangle
+    (x, y, w, h, scale) = FIT((iw, ih), (tx, ty, tw, th)) calculates where
+    an image of size IWxIH ends up when it is scaled (up or down) to fit
+    optimally in the target rectangle with top-left corner (TX, TY) and
+    size TWxTH, preserving its aspect ratio and centering it. (X, Y) is
+    the top-left corner of the scaled image, WxH its size, and SCALE the
+    scale factor. All results are floating point numbers.'''
+    iw, ih = wh # image width, height
+    tx, ty, tw, th = target
+    rat = min(tw / iw, th / ih) # effective scale of image on screen
+    sw = iw * rat # screen width of image
+    sh = ih * rat
+    x0 = tx + (tw - sw) / 2 # screen position of top left of image
+    y0 = ty + (th - sh) / 2
+    return x0, y0, sw, sh, rat
+
+def fit_pixels(wh, target):
+    '''FIT_PIXELS - Placement of an image in a target rectangle, in pixels
+    (x, y, w, h) = FIT_PIXELS((iw, ih), (tx, ty, tw, th)) is like FIT,
+    but rounds the results down to whole pixels, as is done when the
+    image is actually painted.'''
+    x0, y0, sw, sh, rat = fit(wh, target)
+    return int(x0), int(y0), int(sw), int(sh)
+
+
+class ScreenGeometry:
+    '''Class SCREENGEOMETRY: Mapping between image, screen, and visual angle
+    A SCREENGEOMETRY captures the size of a display window, its target
+    rectangle, and the physical size of its pixels once, so that many
+    points can be converted without querying the screen each time.
+    All methods accept numpy arrays (or anything that converts to one)
+    and work on all points at once. Points are arrays whose last
+    dimension holds (x, y) coordinates; angles are in degrees.
+    The width and height of a pixel are calibrated separately, so
+    monitors with non-square pixels are handled correctly.
+    Construct one with DISPLAY.SCREEN_GEOMETRY.'''
+
+    def __init__(self, wh, cm_per_pixel, screendist_cm=None, target=None,
+                 center=None):
+        '''SCREENGEOMETRY - Construct a screen geometry
+        SCREENGEOMETRY((w, h), (cx, cy)) describes a window of WxH pixels
+        in which each pixel measures CX by CY centimeters.
+        Optional argument SCREENDIST_CM specifies the distance between
+        the eye and the screen, which is needed for conversions to and
+        from visual angle.
+        Optional argument TARGET specifies the (x,y,w,h)-quad in which
+        images are shown. Default is the whole window.
+        Optional argument CENTER specifies the screen position (in pixels)
+        that is straight ahead of the eye. Default is the center of the
+        window.'''
+        self.wh = (wh[0], wh[1])
+        self.cm_per_pixel = np.array(cm_per_pixel, float)
+        self.screendist_cm = screendist_cm
+        if target is None:
+            target = (0, 0, wh[0], wh[1])
+        self.target = tuple(target)
+        if center is None:
+            center = (wh[0] / 2, wh[1] / 2)
+        self.center = np.array(center, float)
+
+    def image_to_screen(self, xy, wh):
+        '''IMAGE_TO_SCREEN - Screen position of image pixels
+        xy1 = IMAGE_TO_SCREEN(xy, (w, h)) returns the screen position of
+        the (top-left) corners of pixels at XY in an image of size WxH
+        shown in the target rectangle.'''
+        x0, y0, sw, sh, rat = fit(wh, self.target)
+        return np.asarray(xy, float) * rat + np.array([x0, y0])
+
+    def screen_to_image(self, xy, wh):
+        '''SCREEN_TO_IMAGE - Image position of screen pixels
+        xy1 = SCREEN_TO_IMAGE(xy, (w, h)) is the inverse of
+        IMAGE_TO_SCREEN. The results are not rounded, and may fall
+        outside of the image.'''
+        x0, y0, sw, sh, rat = fit(wh, self.target)
+        return (np.asarray(xy, float) - np.array([x0, y0])) / rat
+
+    def _distance(self):
+        if self.screendist_cm is None:
+            raise ValueError('Screen distance is needed for visual angles')
+        return self.screendist_cm
+
+    def angle_to_pixels(self, theta, axis=0):
+        '''ANGLE_TO_PIXELS - Convert visual angles to pixel counts
+        npix = ANGLE_TO_PIXELS(theta) calculates the number of pixels
+        along the width of the screen corresponding to visual angles
+        THETA, measured from the point straight ahead.
+        Optional argument AXIS may be 1 to use the height rather than
+        the width of the screen. The result is not rounded.'''
+        cm = np.tan(np.asarray(theta, float) * np.pi / 180) * self._distance()
+        return cm / self.cm_per_pixel[axis]
+
+    def pixels_to_angle(self, npix, axis=0):
+        '''PIXELS_TO_ANGLE - Inverse of ANGLE_TO_PIXELS'''
+        cm = np.asarray(npix, float) * self.cm_per_pixel[axis]
+        return (180 / np.pi) * np.arctan(cm / self._distance())
+
+    def screen_to_angle(self, xy):
+        '''SCREEN_TO_ANGLE - Visual angle of screen positions
+        th = SCREEN_TO_ANGLE(xy) returns the horizontal and vertical
+        visual angles of the screen positions XY (in pixels), relative
+        to the point straight ahead. Vertical angles increase downward,
+        like screen coordinates.'''
+        dxy = np.asarray(xy, float) - self.center
+        cm = dxy * self.cm_per_pixel
+        return (180 / np.pi) * np.arctan(cm / self._distance())
+
+    def angle_to_screen(self, theta):
+        '''ANGLE_TO_SCREEN - Inverse of SCREEN_TO_ANGLE'''
+        cm = np.tan(np.asarray(theta, float) * np.pi / 180) * self._distance()
+        return cm / self.cm_per_pixel + self.center
+
+    def image_to_angle(self, xy, wh):
+        '''IMAGE_TO_ANGLE - Visual angle of image pixels
+        IMAGE_TO_ANGLE(xy, (w, h)) combines IMAGE_TO_SCREEN and
+        SCREEN_TO_ANGLE.'''
+        return self.screen_to_angle(self.image_to_screen(xy, wh))
+
+    def angle_to_image(self, theta, wh):
+        '''ANGLE_TO_IMAGE - Inverse of IMAGE_TO_ANGLE'''
+        return self.screen_to_image(self.angle_to_screen(theta), wh)
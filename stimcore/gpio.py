@@ -1,22 +1,194 @@
 #!/usr/bin/python3
 
-try:
-    import RPi.GPIO as gp
-    gp.setmode(gp.BCM)
-    print('Raspberry Pi GPIO enabled')
-    got = True
-except:
-    print('Raspberry Pi GPIO not enabled')
-    got = False
+import time
+import threading
+import collections
+
+
+class Backend:
+    '''Class BACKEND: Interface for GPIO hardware
+    Subclasses implement MAKE_OUTPUT and WRITE. WRITE_MANY writes
+    several pins at once; subclasses may implement it more efficiently
+    than by calling WRITE for each pin.'''
+    def make_output(self, pin):
+        '''MAKE_OUTPUT - Configure a pin as an output'''
+        raise NotImplementedError
+
+    def write(self, pin, val):
+        '''WRITE - Set an output pin high (VAL=1) or low (VAL=0)'''
+        raise NotImplementedError
+
+    def write_many(self, pins, vals):
+        '''WRITE_MANY - Set several output pins at once'''
+        for pin, val in zip(pins, vals):
+            self.write(pin, val)
+
+
+class RPiBackend(Backend):
+    '''Class RPIBACKEND: GPIO through the RPi.GPIO library'''
+    def __init__(self):
+        import RPi.GPIO as gp
+        gp.setmode(gp.BCM)
+        self.gp = gp
+
+    def make_output(self, pin):
+        self.gp.setup(pin, self.gp.OUT)
+
+    def write(self, pin, val):
+        self.gp.output(int(pin), int(val))
+
+    def write_many(self, pins, vals):
+        # RPi.GPIO only accepts plain Python ints, not numpy integers
+        self.gp.output([int(p) for p in pins], [int(v) for v in vals])
+
+
+class BitmaskBackend(Backend):
+    '''Class BITMASKBACKEND: GPIO through direct register access
+    This backend maps the Raspberry Pi's GPIO registers from /dev/gpiomem,
+    so that WRITE_MANY sets all the high pins with a single write to the
+    GPSET0 register and all the low pins with a single write to GPCLR0.
+    Only pins 0-31 are supported.'''
+    GPSET0 = 0x1c
+    GPCLR0 = 0x28
+
+    def __init__(self, device='/dev/gpiomem'):
+        import mmap
+        with open(device, 'r+b') as fd:
+            self.mem = mmap.mmap(fd.fileno(), 4096)
+        # Registers must be accessed as whole 32-bit words
+        self.regs = memoryview(self.mem).cast('I')
+
+    def _reg(self, offset):
+        return self.regs[offset // 4]
+
+    def _setreg(self, offset, value):
+        self.regs[offset // 4] = value
+
+    def make_output(self, pin):
+        if pin < 0 or pin > 31:
+            raise ValueError('Only GPIO pins 0-31 are supported')
+        offset = 4 * (pin // 10) # GPFSELn
+        shift = 3 * (pin % 10)
+        value = self._reg(offset) & ~(7 << shift)
+        self._setreg(offset, value | (1 << shift))
+
+    def write(self, pin, val):
+        self.write_many([pin], [val])
+
+    def write_many(self, pins, vals):
+        setmask = 0
+        clrmask = 0
+        for pin, val in zip(pins, vals):
+            if val:
+                setmask |= 1 << pin
+            else:
+                clrmask |= 1 << pin
+        if setmask:
+            self._setreg(BitmaskBackend.GPSET0, setmask)
+        if clrmask:
+            self._setreg(BitmaskBackend.GPCLR0, clrmask)
+
+
+class RecordingBackend(Backend):
+    '''Class RECORDINGBACKEND: GPIO that only records what is written
+    Every write is appended to the EVENTS member as a (t, pin, val)
+    triplet, where T is from time.perf_counter. Useful for testing
+    and benchmarking without hardware.'''
+    def __init__(self):
+        self.outputs = set()
+        self.events = []
+
+    def make_output(self, pin):
+        self.outputs.add(pin)
+
+    def write(self, pin, val):
+        self.events.append((time.perf_counter(), pin, val))
+
+    def write_many(self, pins, vals):
+        t = time.perf_counter()
+        for pin, val in zip(pins, vals):
+            self.events.append((t, pin, val))
+
+
+class NullBackend(Backend):
+    '''Class NULLBACKEND: GPIO that does nothing'''
+    def make_output(self, pin):
+        pass
+
+    def write(self, pin, val):
+        pass
+
+    def write_many(self, pins, vals):
+        pass
+
+
+backend = None # Chosen when first needed, see GET_BACKEND
+_queue = collections.deque()
+_wakeup = threading.Condition()
+_writer = None
+
+def set_backend(b):
+    '''SET_BACKEND - Select the GPIO backend
+    SET_BACKEND(b), where B is a BACKEND, makes all subsequent GPIO
+    operations go through B. By default, RPiBackend is used if the
+    RPi.GPIO library is available, and NullBackend otherwise. The
+    hardware is not probed until a GPIO is first used, so there is no
+    need to call SET_BACKEND before importing other modules.'''
+    global backend
+    flush()
+    backend = b
+
+def get_backend():
+    '''GET_BACKEND - Return the current GPIO backend
+    GET_BACKEND() returns the current backend. If none has been set,
+    this is where the default is chosen (see SET_BACKEND).'''
+    global backend
+    if backend is None:
+        try:
+            backend = RPiBackend()
+        except Exception:
+            backend = NullBackend()
+    return backend
 
 def make_output(pin):
-    if got:
-        gp.setup(pin, gp.OUT)
-    else:
-        print(f'gpio {pin}')
+    get_backend().make_output(pin)
 
 def write(pin, val):
-    if got:
-        gp.output(pin, val)
-    else:
-        print(f'gpio {pin} -> {val}')
+    get_backend().write(pin, val)
+
+def write_many(pins, vals):
+    '''WRITE_MANY - Set several output pins at once'''
+    get_backend().write_many(pins, vals)
+
+def post(pins, vals):
+    '''POST - Set several output pins at once, without waiting
+    POST(pins, vals) hands the write to a background thread, so that
+    the caller (typically the paint routine) is not slowed down by it.
+    Writes are performed in the order in which they are posted.'''
+    global _writer
+    with _wakeup:
+        _queue.append((list(pins), list(vals)))
+        if _writer is None:
+            _writer = threading.Thread(target=_write_posted, daemon=True)
+            _writer.start()
+        _wakeup.notify_all()
+
+def flush():
+    '''FLUSH - Wait until all posted writes have been performed'''
+    with _wakeup:
+        while _queue:
+            _wakeup.wait()
+
+def _write_posted():
+    while True:
+        with _wakeup:
+            while not _queue:
+                _wakeup.wait()
+            pins, vals = _queue[0]
+        try:
+            get_backend().write_many(pins, vals)
+        except Exception as e:
+            print(f'gpio write failed: {e}')
+        with _wakeup:
+            _queue.popleft()
+            _wakeup.notify_all()
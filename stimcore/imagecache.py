@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+import threading
+import collections
+
+
+class ImageCache:
+    '''Class IMAGECACHE: Bounded LRU cache of decoded images
+    An IMAGECACHE holds decoded images up to a given total size in
+    memory, discarding the least recently used images when that size
+    is exceeded. Images are produced on demand by a LOADER function.
+    A background thread can decode images ahead of time (see PREFETCH),
+    so that GET normally does not have to wait for decoding.
+
+    Images are kept as QImages, in whatever format the LOADER returns,
+    because QPixmaps may only be created in the GUI thread.'''
+
+    def __init__(self, loader, max_mb=512):
+        '''IMAGECACHE - Construct a cache
+        IMAGECACHE(loader) constructs a cache that uses the given LOADER
+        function to produce an image given a key. LOADER must return
+        a QImage and must be safe to call from a non-GUI thread.
+        Optional argument MAX_MB specifies the maximum total size of
+        cached images, in megabytes.'''
+        self.loader = loader
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.images = collections.OrderedDict()
+        self.nbytes = 0
+        self.pending = collections.deque()
+        self.loading = set()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def get(self, key):
+        '''GET - Retrieve an image from the cache
+        GET(key) returns the image for the given KEY, decoding it first
+        if it is not in the cache. If the image is currently being
+        decoded by the prefetch thread, GET waits for that to finish.'''
+        with self.cond:
+            while key in self.loading:
+                self.cond.wait()
+            if key in self.images:
+                self.images.move_to_end(key)
+                return self.images[key]
+            self.loading.add(key)
+        return self._load(key)
+
+    def prefetch(self, keys):
+        '''PREFETCH - Decode images in the background
+        PREFETCH(keys) schedules the images for the given KEYS to be
+        decoded by a background thread, unless they are already cached.'''
+        with self.cond:
+            for key in keys:
+                if key not in self.images and key not in self.loading:
+                    self.pending.append(key)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._work,
+                                               daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def clear(self):
+        '''CLEAR - Drop all images from the cache'''
+        with self.cond:
+            self.pending.clear()
+            self.images.clear()
+            self.nbytes = 0
+
+    def _load(self, key):
+        try:
+            img = self.loader(key)
+        except:
+            with self.cond:
+                self.loading.discard(key)
+                self.cond.notify_all()
+            raise
+        with self.cond:
+            self.loading.discard(key)
+            self.images[key] = img
+            self.nbytes += img.sizeInBytes()
+            while self.nbytes > self.max_bytes and len(self.images) > 1:
+                _, old = self.images.popitem(last=False)
+                self.nbytes -= old.sizeInBytes()
+            self.cond.notify_all()
+        return img
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                key = self.pending.popleft()
+                if key in self.images or key in self.loading:
+                    continue
+                self.loading.add(key)
+            try:
+                self._load(key)
+            except Exception as e:
+                print(f'Failed to prefetch image {key}: {e}')
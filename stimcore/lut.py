@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+import numpy as np
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage
+from . import stimulus
+from . import geometry
+from . import qtapp
+
+
+class LutStimulus(stimulus.Stimulus):
+    '''Class LUTSTIMULUS: One indexed image under changing color tables
+    A LUTSTIMULUS holds a single image of 8-bit indices and, for every
+    frame, a color table that maps those indices to colors. The display
+    applies the table while it paints. This is ideal for drifting
+    gratings and other stimuli in which every frame shows the same
+    spatial pattern under a different intensity mapping: phase and
+    contrast are changed just by changing the tables.
+    For instance, a drifting grating is an index image that increases
+    linearly along the direction of motion, combined with tables that
+    contain a cosine with a different phase in each frame.
+    The most important methods are:
+      - SET_INDEX_IMAGE - Specify the image of indices
+      - SET_TABLES - Specify the color tables for all frames
+    Refresh rate, delays, and background color are set as for a STIMULUS.
+    The presentation order is simply one entry per color table;
+    SET_ORDER is not used.'''
+    def __init__(self, index=None):
+        '''LUTSTIMULUS - Construct a color table stimulus
+        LUTSTIMULUS() constructs an empty color table stimulus.
+        LUTSTIMULUS(index) immediately sets the index image (see
+        SET_INDEX_IMAGE).'''
+        super().__init__()
+        self.index = None
+        self.tables = np.zeros((0, 256), np.uint32)
+        self.scaled_index = {} # Scaled index images, by target
+        if index is not None:
+            self.set_index_image(index)
+
+    def set_index_image(self, index):
+        '''SET_INDEX_IMAGE - Specify the image of indices
+        SET_INDEX_IMAGE(index), where INDEX is an HxW array of integers
+        between 0 and 255, specifies the pattern shown in every frame.'''
+        stimulus.Stimulus.app = qtapp.get_app()
+
+        index = np.asarray(index)
+        if index.ndim != 2:
+            raise ValueError('Index image must be HxW')
+        if not np.issubdtype(index.dtype, np.integer):
+            raise ValueError('Index image must be of integer type')
+        if np.any(index < 0) or np.any(index > 255):
+            raise ValueError('Indices must be between 0 and 255')
+        ar = np.ascontiguousarray(index, np.uint8)
+        h, w = ar.shape
+        img = QImage(ar.data, w, h, w, QImage.Format_Indexed8)
+        img.setColorCount(256)
+        self.index = img.copy() # Owns its data
+        self.fns = []
+        self.images = []
+        self.nbytes = 0
+        self._store(self.index)
+        self.fns.append('index')
+        self.scaled_index.clear()
+
+    def set_tables(self, tables):
+        '''SET_TABLES - Specify the color tables for all frames
+        SET_TABLES(tables), where TABLES is an Nx256x3 array, specifies
+        the RGB color of each index in each of N frames. TABLES may also
+        be Nx256 for grayscale. Values are interpreted as in
+        STIMULUS.ADD_IMAGE_FROM_ARRAY: integers from 0 to 255, or
+        floating point numbers from 0.0 to 1.0. Values outside that
+        range are clipped.
+        The number of frames in the stimulus is N.'''
+        tables = np.asarray(tables)
+        if tables.ndim==2:
+            tables = np.stack([tables, tables, tables], 2)
+        if tables.ndim != 3 or tables.shape[1:] != (256, 3):
+            raise ValueError('Color tables must be Nx256x3 or Nx256')
+        if not np.issubdtype(tables.dtype, np.integer):
+            tables = 255.99999*tables
+        # Out-of-range values would spill into the neighboring channel
+        tables = np.clip(tables, 0, 255).astype(np.uint32)
+        self.tables = (0xff000000 | (tables[:, :, 0] << 16)
+                       | (tables[:, :, 1] << 8) | tables[:, :, 2])
+
+    def presentation_order(self, f_Hz=None):
+        '''PRESENTATION_ORDER - Return presentation order
+        PRESENTATION_ORDER() returns a list of frame numbers, one for
+        each color table.'''
+        return list(range(len(self.tables)))
+
+    def memory_usage(self):
+        '''MEMORY_USAGE - Memory used by images and the color tables'''
+        return super().memory_usage() + self.tables.nbytes
+
+    def in_memory(self, k):
+        return False
+
+    def is_composite(self):
+        return True
+
+    def compose(self, k, target, smooth=False):
+        '''COMPOSE - Layers that make up a frame
+        layers = COMPOSE(k, target) returns a list containing the single
+        layer (img, x, y, 1) for frame K: the index image scaled for the
+        given TARGET rectangle, with the color table of frame K applied.
+        Indices cannot be interpolated, so the index image is always
+        scaled with nearest-neighbor scaling, regardless of SMOOTH.
+        See RENDER.PAINT_FRAME.'''
+        if self.index is None:
+            return []
+        key = tuple(target)
+        if key not in self.scaled_index:
+            iw = self.index.width()
+            ih = self.index.height()
+            x0, y0, sw, sh = geometry.fit_pixels((iw, ih), target)
+            if sw <= 0 or sh <= 0:
+                self.scaled_index[key] = (None, 0, 0)
+            else:
+                img = self.index.scaled(sw, sh, Qt.IgnoreAspectRatio,
+                                        Qt.FastTransformation)
+                self.scaled_index[key] = (img, x0, y0)
+        img, x0, y0 = self.scaled_index[key]
+        if img is None:
+            return []
+        img = QImage(img) # Shares data until the color table is set
+        img.setColorTable(self.tables[k].tolist())
+        return [(img, x0, y0, 1)]
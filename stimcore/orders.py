@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+
+class RunLength:
+    '''Class RUNLENGTH: Run-length encoded presentation order
+    A RUNLENGTH represents a presentation order in which each image is
+    held for some duration, without storing an ID for every frame. It
+    is constructed by STIMULUS.SET_TIMED_ORDER.
+    Once its durations are in frames (see IN_FRAMES), a RUNLENGTH
+    behaves like a read-only list of image IDs, one per frame, so that
+    it can be used wherever a presentation order is expected.'''
+
+    def __init__(self, ids, durations, unit='frames'):
+        '''RUNLENGTH - Construct a run-length encoded order
+        RUNLENGTH(ids, durations) constructs an order in which image
+        IDS[n] is shown for DURATIONS[n] frames.
+        Optional argument UNIT may be "frames" (the default) or "s",
+        in which case durations are in seconds.'''
+        if unit not in ('frames', 's'):
+            raise ValueError('Unit must be "frames" or "s"')
+        self.ids = np.asarray(ids, np.int64)
+        self.durations = np.asarray(durations, float)
+        self.unit = unit
+        if self.ids.ndim != 1 or self.ids.shape != self.durations.shape:
+            raise ValueError('Must have one duration for each image ID')
+        if np.any(self.durations < 0):
+            raise ValueError('Durations must not be negative')
+        self.ends = None # Frame number at the end of each entry
+        if unit=='frames':
+            nframes = np.round(self.durations)
+            if np.any(nframes != self.durations):
+                raise ValueError('Durations in frames must be whole numbers')
+            self.ends = np.cumsum(nframes.astype(np.int64))
+
+    def in_frames(self, f_Hz):
+        '''IN_FRAMES - Convert durations to frames
+        IN_FRAMES(f_Hz) returns a RUNLENGTH with durations in frames at
+        a presentation rate of F_HZ. Durations in seconds are rounded
+        such that rounding errors do not accumulate; entries that end
+        up shorter than a frame are not shown. If durations are already
+        in frames, the RUNLENGTH itself is returned.'''
+        if self.unit=='frames':
+            return self
+        ends = np.round(np.cumsum(self.durations) * f_Hz).astype(np.int64)
+        return RunLength(self.ids, np.diff(ends, prepend=0))
+
+    def counts(self):
+        '''COUNTS - Number of frames for each entry'''
+        return np.diff(self.ends, prepend=0)
+
+    def __len__(self):
+        if self.ends is None:
+            raise ValueError('Durations must be converted to frames first')
+        if len(self.ends)==0:
+            return 0
+        return int(self.ends[-1])
+
+    def __getitem__(self, k):
+        N = len(self)
+        if isinstance(k, slice):
+            k0, k1, step = k.indices(N)
+            return [self[k] for k in range(k0, k1, step)]
+        if k < 0:
+            k += N
+        if k < 0 or k >= N:
+            raise IndexError('Frame number out of range')
+        return int(self.ids[np.searchsorted(self.ends, k, 'right')])
+
+    def __iter__(self):
+        return iter(self.__array__().tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        len(self) # Checks that durations are in frames
+        ar = np.repeat(self.ids, self.counts())
+        if dtype is not None:
+            ar = ar.astype(dtype)
+        return ar
+
+
+class Stream:
+    '''Class STREAM: Presentation order produced on demand
+    A STREAM wraps an iterable of image IDs, typically a generator such
+    as those returned by BLOCK_RANDOM and MSEQUENCE, and reads from it
+    only as far as the display asks. The display reads just a few
+    frames ahead of the one it is showing, so a very long order never
+    has to be built in advance. It is constructed by STIMULUS.SET_ORDER.
+    Every entry that is read is recorded (see REALIZED), so that asking
+    for an earlier frame returns the same ID again, and showing the
+    stimulus a second time repeats the realized order exactly.
+    A STREAM behaves like a read-only list of image IDs, one per frame.'''
+
+    def __init__(self, source, length):
+        '''STREAM - Construct an order that is read on demand
+        STREAM(source, length) constructs an order of LENGTH frames,
+        with image IDs taken from the iterable SOURCE. SOURCE must
+        produce at least that many IDs; any more are not read.'''
+        if length < 0:
+            raise ValueError('Length must not be negative')
+        self.source = iter(source)
+        self.length = int(length)
+        self.ids = np.zeros(min(self.length, 1024), np.int64)
+        self.count = 0 # Number of entries read from the source
+
+    def realized(self):
+        '''REALIZED - The entries read so far
+        ids = REALIZED() returns a numpy array of the image IDs that
+        have been read from the source so far, in order. This may
+        include a few frames past the end of a cancelled run.'''
+        return self.ids[:self.count].copy()
+
+    def _read_to(self, n):
+        n = min(n, self.length)
+        if n <= self.count:
+            return
+        if n > len(self.ids):
+            ids = np.zeros(min(max(n, 2*len(self.ids)), self.length), np.int64)
+            ids[:self.count] = self.ids[:self.count]
+            self.ids = ids
+        while self.count < n:
+            try:
+                self.ids[self.count] = next(self.source)
+            except StopIteration:
+                raise ValueError(f'Order ended after {self.count} '
+                                 + f'of {self.length} frames')
+            self.count += 1
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, k):
+        N = len(self)
+        if isinstance(k, slice):
+            k0, k1, step = k.indices(N)
+            ks = range(k0, k1, step)
+            if len(ks):
+                self._read_to(max(ks[0], ks[-1]) + 1)
+            return [int(self.ids[k]) for k in ks]
+        if k < 0:
+            k += N
+        if k < 0 or k >= N:
+            raise IndexError('Frame number out of range')
+        self._read_to(k + 1)
+        return int(self.ids[k])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __array__(self, dtype=None, copy=None):
+        self._read_to(self.length)
+        ar = self.ids[:self.length].copy()
+        if dtype is not None:
+            ar = ar.astype(dtype)
+        return ar
+
+
+def distinct(order):
+    '''DISTINCT - The image IDs that occur in an order
+    ids = DISTINCT(order) returns a sorted list of the distinct image
+    IDs in ORDER, which may be a list, a numpy array, a RUNLENGTH, or
+    a STREAM. Note that a STREAM is read to its end.'''
+    if isinstance(order, RunLength):
+        order = order.ids[order.durations > 0]
+    return np.unique(np.asarray(order, np.int64)).tolist()
+
+
+def block_random(ids, blocks=None, hold=1, seed=None):
+    '''BLOCK_RANDOM - Orders with seeded block randomization
+    gen = BLOCK_RANDOM(ids) returns a generator that yields the given
+    image IDS in random order, then again in a new random order, and so
+    on forever. Each ID thus occurs exactly once in every block of
+    LEN(IDS) entries.
+    Optional argument BLOCKS limits the number of blocks.
+    Optional argument HOLD makes each ID repeat for that many frames.
+    Optional argument SEED seeds the random number generator, so that
+    the order can be reproduced.
+    The result is meant for STIMULUS.SET_ORDER.'''
+    ids = np.asarray(ids, np.int64)
+    if ids.ndim != 1 or len(ids)==0:
+        raise ValueError('IDs must be a nonempty list')
+    if hold < 1:
+        raise ValueError('Hold must be at least one frame')
+    rng = np.random.default_rng(seed)
+    def generate():
+        b = 0
+        while blocks is None or b < blocks:
+            for id in rng.permutation(ids).tolist():
+                for h in range(hold):
+                    yield id
+            b += 1
+    return generate()
+
+
+# Feedback taps (exponents of primitive polynomials) for MSEQUENCE
+_TAPS = {2: (2, 1), 3: (3, 2), 4: (4, 3), 5: (5, 3), 6: (6, 5), 7: (7, 6),
+         8: (8, 6, 5, 4), 9: (9, 5), 10: (10, 7), 11: (11, 9),
+         12: (12, 6, 4, 1), 13: (13, 4, 3, 1), 14: (14, 5, 3, 1),
+         15: (15, 14), 16: (16, 15, 13, 4), 17: (17, 14), 18: (18, 11),
+         19: (19, 6, 2, 1), 20: (20, 17)}
+
+
+def msequence(nbits, ids=(0, 1), hold=1, periods=None, state=1):
+    '''MSEQUENCE - Orders that follow a maximum-length sequence
+    gen = MSEQUENCE(nbits) returns a generator that yields a binary
+    m-sequence with period 2^NBITS - 1, produced by a linear feedback
+    shift register, with bits mapped to image IDs 0 and 1. The sequence
+    repeats forever. NBITS must be between 2 and 20.
+    Optional argument IDS specifies the image IDs for 0 and 1 bits.
+    Optional argument HOLD makes each ID repeat for that many frames.
+    Optional argument PERIODS limits the number of periods.
+    Optional argument STATE specifies the initial state of the register,
+    which must be nonzero. Different states give shifted sequences.
+    The result is meant for STIMULUS.SET_ORDER.'''
+    if nbits not in _TAPS:
+        raise ValueError('Number of bits must be between 2 and 20')
+    if hold < 1:
+        raise ValueError('Hold must be at least one frame')
+    if state <= 0 or state >= 2**nbits:
+        raise ValueError(f'State must be between 1 and {2**nbits - 1}')
+    taps = _TAPS[nbits]
+    id0, id1 = ids
+    def generate():
+        reg = state
+        n = 0
+        while periods is None or n < periods * (2**nbits - 1):
+            id = id1 if reg & 1 else id0
+            for h in range(hold):
+                yield id
+            bit = 0
+            for t in taps:
+                bit ^= reg >> (nbits - t)
+            reg = (reg >> 1) | ((bit & 1) << (nbits - 1))
+            n += 1
+    return generate()
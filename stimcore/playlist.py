@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+
+class Playlist:
+    '''Class PLAYLIST: Several stimulus sequences shown back to back
+    A PLAYLIST holds a list of STIMULUS objects, each with its own
+    target rectangle. DISPLAY.RUN_PLAYLIST shows them one after the
+    other in a single session, switching from one to the next on a frame
+    boundary without any idle time, and preparing the images of the next
+    stimulus while the current one plays.
+    Each stimulus keeps its own refresh rate, initial and final delays,
+    and background color. The initial delay of a stimulus starts right
+    at the end of the final delay of the previous one.'''
+    def __init__(self):
+        self.blocks = []
+
+    def add(self, stim, target=None, smooth=False):
+        '''ADD - Add a stimulus sequence to the playlist
+        ADD(stim) adds a stimulus sequence to the end of the playlist.
+        Optional arguments TARGET and SMOOTH are as for DISPLAY.RUN.
+        Returns the position of the stimulus in the playlist, which is
+        the BLOCK number in the timing record of a run.'''
+        self.blocks.append((stim, target, smooth))
+        return len(self.blocks) - 1
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, n):
+        return self.blocks[n]
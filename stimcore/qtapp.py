@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+
+import os
+from PyQt5.QtWidgets import QApplication
+
+
+def get_app():
+    '''GET_APP - The Qt application, created when first needed
+    app = GET_APP() returns the QApplication, creating it if it does
+    not yet exist. If no X display is specified in the environment,
+    the application connects to display ":0", so that scripts started
+    from ssh or cron still show their stimuli on the local screen.
+    Everything in StimCore that needs Qt calls this first.'''
+    app = QApplication.instance()
+    if app is None:
+        if 'DISPLAY' not in os.environ or os.environ['DISPLAY'] == '':
+            os.environ['DISPLAY'] = ':0'
+        app = QApplication(['stimcore'])
+    return app
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+import os
+import numpy as np
+import concurrent.futures
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QPainter, QColor, QImage, QPixmap
+from . import geometry
+from . import sync
+from . import orders
+
+
+def scale_image(img, target, smooth=False):
+    '''SCALE_IMAGE - Scale an image to fit a target rectangle
+    (img1, x, y) = SCALE_IMAGE(img, target) scales the QImage or QPixmap
+    IMG to fit in the TARGET rectangle (an (x,y,w,h)-quad in pixels) and
+    returns the result along with the position of its top-left corner.
+    If IMG is empty, the result is (None, 0, 0).
+    Optional argument SMOOTH selects smooth rather than nearest-neighbor
+    scaling.'''
+    iw = img.width() # image size (pix)
+    ih = img.height()
+    if iw<=0 or ih<=0:
+        return (None, 0, 0)
+    x0, y0, sw, sh = geometry.fit_pixels((iw, ih), target)
+    if smooth:
+        mode = Qt.SmoothTransformation
+    else:
+        mode = Qt.FastTransformation
+    return (img.scaled(sw, sh, Qt.IgnoreAspectRatio, mode), x0, y0)
+
+
+def paint_frame(p, size, background, scaled=None, photodiodes=[], on=[],
+                region=None):
+    '''PAINT_FRAME - Paint one frame of a stimulus
+    PAINT_FRAME(p, (w, h), rgb) uses the QPainter P to fill a canvas of
+    size WxH with the background color RGB.
+    PAINT_FRAME(p, (w, h), rgb, scaled, photodiodes, on) additionally
+    draws a scaled image, as returned by SCALE_IMAGE, and photodiode
+    rectangles, which are white where the corresponding element of ON
+    is True and black otherwise.
+    SCALED may also be a list of (img, x, y, opacity) layers, as returned
+    by the COMPOSE method of composite stimuli, which are drawn in
+    order.
+    Optional argument REGION, a QRegion, limits filling with the
+    background color to the given region.
+    This is used both by the DISPLAY and by RENDER, so that offline
+    renderings are identical to what is shown on the screen.'''
+    col = QColor(background[0], background[1], background[2])
+    if region is None:
+        p.fillRect(QRect(0, 0, size[0], size[1]), col)
+    else:
+        for rect in region.rects():
+            p.fillRect(rect, col)
+    if scaled is None:
+        return
+    if isinstance(scaled, list):
+        layers = scaled
+    else:
+        layers = [scaled + (1,)]
+    for img, x0, y0, opacity in layers:
+        p.setOpacity(opacity)
+        if isinstance(img, QImage):
+            p.drawImage(x0, y0, img)
+        elif img is not None:
+            p.drawPixmap(x0, y0, img)
+    p.setOpacity(1)
+    for pd, o in zip(photodiodes, on):
+        x,y,w,h = pd.rect
+        if o:
+            col = QColor(255,255,255)
+        else:
+            col = QColor(0,0,0)
+        p.fillRect(QRect(x,y,w,h), col)
+
+
+def render(stim, size, target=None, smooth=False, photodiodes=[],
+           out=None, workers=None):
+    '''RENDER - Render a stimulus sequence offline
+    frames = RENDER(stim, (w, h)) renders every frame of the stimulus
+    sequence STIM as it would appear on a WxH screen, and returns the
+    result as an NxHxWx3 uint8 array (RGB). No timers are involved:
+    rendering proceeds as fast as possible, using a pool of worker
+    threads.
+    Optional arguments TARGET, SMOOTH, and PHOTODIODES have the same
+    meaning as for DISPLAY.RUN and DISPLAY.ADD_PHOTODIODE. PHOTODIODES
+    must be a list of objects with RECT, PERIOD, and DELAY members.
+    Optional argument OUT streams the frames to a file rather than
+    keeping them in memory. If OUT ends in ".npy", the result is a
+    memory-mapped .npy file, which is returned. Otherwise, frames are
+    written as raw RGB24 video (as understood by, e.g., "ffmpeg -f rawvideo
+    -pix_fmt rgb24 -s WxH"), and the result is None.
+    Optional argument WORKERS specifies the number of worker threads.'''
+    W, H = size
+    if target is None:
+        target = [0, 0, W, H]
+    order = stim.presentation_order()
+    if isinstance(order, orders.Stream):
+        # Workers must not read from the stream concurrently
+        order = np.asarray(order)
+    N = len(order)
+    on = sync.plan(N, photodiodes)
+
+    # QPixmaps may only be used in the GUI thread, so we scale the
+    # in-memory images here, and the others in the workers.
+    scaled = {}
+    for imgid in set(stim.original_id(k) for k in orders.distinct(order)):
+        if stim.in_memory(imgid):
+            img = stim.get_image(imgid)
+            if isinstance(img, QPixmap):
+                img = img.toImage()
+            scaled[imgid] = scale_image(img, target, smooth)
+
+    def render_one(k):
+        imgid = stim.original_id(order[k])
+        if stim.is_composite():
+            img = stim.compose(order[k], target, smooth)
+        elif imgid in scaled:
+            img = scaled[imgid]
+        else:
+            img = stim.scale_image(imgid, target, smooth)
+        canvas = QImage(W, H, QImage.Format_RGB888)
+        p = QPainter(canvas)
+        paint_frame(p, size, stim.background, img, photodiodes, on[k])
+        p.end()
+        bpl = canvas.bytesPerLine()
+        ptr = canvas.constBits()
+        ptr.setsize(H * bpl)
+        ar = np.frombuffer(ptr, np.uint8).reshape(H, bpl)
+        return ar[:, :3*W].reshape(H, W, 3).copy()
+
+    rawfile = None
+    if out is None:
+        frames = np.zeros((N, H, W, 3), np.uint8)
+    elif out.endswith('.npy'):
+        frames = np.lib.format.open_memmap(out, 'w+', np.uint8, (N, H, W, 3))
+    else:
+        frames = None
+        rawfile = open(out, 'wb')
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        chunk = 4 * workers # Limits the number of frames in flight
+        for k0 in range(0, N, chunk):
+            ks = range(k0, min(k0 + chunk, N))
+            for k, ar in zip(ks, pool.map(render_one, ks)):
+                if rawfile is None:
+                    frames[k] = ar
+                else:
+                    rawfile.write(ar.tobytes())
+    if rawfile is not None:
+        rawfile.close()
+    elif out is not None:
+        frames.flush()
+    return frames
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+import time
+from PyQt5.QtCore import Qt, QTimer
+
+
+class Scheduler:
+    '''Class SCHEDULER: Calls a function at absolute deadlines
+    A SCHEDULER measures time from the moment START is called, and
+    calls a given function when each deadline passed to SCHEDULE is
+    reached. Because deadlines are absolute rather than relative to
+    the previous one, rounding errors and jitter do not accumulate
+    over the course of a long run.
+    Qt timers only have millisecond resolution. For better precision,
+    the scheduler can fire a little early and spend the remaining time
+    in a busy-wait loop.'''
+
+    def __init__(self, parent, callback, busy_wait_s=0):
+        '''SCHEDULER - Construct a scheduler
+        SCHEDULER(parent, callback) constructs a scheduler that calls
+        the CALLBACK function (without arguments) at each deadline. Its
+        timer is owned by the QObject PARENT.
+        Optional argument BUSY_WAIT_S specifies how long before each
+        deadline the timer fires, after which the scheduler waits
+        actively until the deadline is reached.'''
+        self.callback = callback
+        self.busy_wait_s = busy_wait_s
+        self.timer = QTimer(parent)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._fire)
+        self.t0 = time.perf_counter()
+        self.deadline = None
+
+    def start(self):
+        '''START - Reset the clock
+        START() makes the current moment time zero.'''
+        self.t0 = time.perf_counter()
+
+    def now(self):
+        '''NOW - Current time
+        NOW() returns the time since START, in seconds.'''
+        return time.perf_counter() - self.t0
+
+    def schedule(self, t):
+        '''SCHEDULE - Arrange for the callback to be called
+        SCHEDULE(t) arranges for the callback to be called at time T,
+        measured in seconds since START. If T has already passed, the
+        callback is called as soon as control returns to the event loop.
+        Only one deadline is pending at any time.'''
+        self.deadline = t
+        dt = t - self.now() - self.busy_wait_s
+        self.timer.start(max(0, round(1000 * dt)))
+
+    def stop(self):
+        '''STOP - Cancel the pending deadline'''
+        self.timer.stop()
+        self.deadline = None
+
+    def _fire(self):
+        if self.busy_wait_s > 0:
+            t1 = self.t0 + self.deadline
+            while time.perf_counter() < t1:
+                pass
+        self.callback()
+
+
+class SwapScheduler:
+    '''Class SWAPSCHEDULER: Calls a function at buffer swaps
+    A SWAPSCHEDULER has the same interface as a SCHEDULER, but rather
+    than using a timer, it counts buffer swaps of an OpenGL widget that
+    swaps in sync with the monitor's vertical refresh. Deadlines are
+    rounded to the nearest refresh. While a deadline is pending, the
+    widget is kept repainting so that a swap occurs at every refresh.
+    The owner must call SWAPPED whenever the widget's frameSwapped
+    signal fires.'''
+
+    def __init__(self, widget, callback, refresh_Hz):
+        '''SWAPSCHEDULER - Construct a scheduler
+        SWAPSCHEDULER(widget, callback, refresh_Hz) constructs a scheduler
+        that calls the CALLBACK function (without arguments) at the buffer
+        swap of the given WIDGET that is nearest to each deadline.
+        REFRESH_HZ must be the refresh rate of the monitor.'''
+        self.widget = widget
+        self.callback = callback
+        self.refresh_Hz = refresh_Hz
+        self.t0 = time.perf_counter()
+        self.swaps = 0
+        self.swap0 = 0
+        self.target = None
+        self.deadline = None
+
+    def start(self):
+        '''START - Reset the clock
+        START() makes the current moment time zero, and the next buffer
+        swap swap number one.'''
+        self.t0 = time.perf_counter()
+        self.swap0 = self.swaps
+
+    def now(self):
+        '''NOW - Current time
+        NOW() returns the time since START, in seconds.'''
+        return time.perf_counter() - self.t0
+
+    def schedule(self, t):
+        '''SCHEDULE - Arrange for the callback to be called
+        SCHEDULE(t) arranges for the callback to be called at the buffer
+        swap nearest to time T, measured in seconds since START.'''
+        self.deadline = t
+        self.target = self.swap0 + round(t * self.refresh_Hz)
+        self.widget.update()
+
+    def stop(self):
+        '''STOP - Cancel the pending deadline'''
+        self.target = None
+        self.deadline = None
+
+    def swapped(self):
+        '''SWAPPED - Notify the scheduler of a buffer swap'''
+        self.swaps += 1
+        if self.target is None:
+            return
+        if self.swaps >= self.target:
+            self.target = None
+            self.callback()
+        else:
+            self.widget.update()
+
+
+class FollowerScheduler:
+    '''Class FOLLOWERSCHEDULER: Uses the clock of another display
+    A FOLLOWERSCHEDULER has the same interface as a SCHEDULER, but it
+    never calls anything by itself. It is used by the displays of a
+    DISPLAYGROUP other than the first, which are driven by the first
+    display's scheduler, so that all displays advance in the same tick.
+    NOW returns the time of the leading display's scheduler.'''
+
+    def __init__(self, leader):
+        '''FOLLOWERSCHEDULER - Construct a scheduler
+        FOLLOWERSCHEDULER(leader) constructs a scheduler that follows
+        the display LEADER, whose SCHEDULER member provides the clock.'''
+        self.leader = leader
+        self.deadline = None
+
+    def start(self):
+        '''START - Does nothing: the leader's clock is used'''
+        pass
+
+    def now(self):
+        '''NOW - Current time
+        NOW() returns the time since the leader's scheduler was started.'''
+        return self.leader.scheduler.now()
+
+    def schedule(self, t):
+        '''SCHEDULE - Record a deadline
+        SCHEDULE(t) only records T; the leader calls the callback.'''
+        self.deadline = t
+
+    def stop(self):
+        '''STOP - Forget the pending deadline'''
+        self.deadline = None
+
+    def swapped(self):
+        '''SWAPPED - Does nothing: the leader counts buffer swaps'''
+        pass
@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+import math
+import numpy as np
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtGui import QImage
+from . import stimulus
+from . import geometry
+from . import qtapp
+
+
+class SpriteStimulus(stimulus.Stimulus):
+    '''Class SPRITESTIMULUS: Small images moving over a background
+    A SPRITESTIMULUS does not store an image for every frame. Instead,
+    it holds a few small "sprite" images and a table that specifies,
+    for every frame, where each sprite is drawn on a virtual canvas
+    and with what opacity. The display composes each frame while it
+    is painted. This is ideal for moving bars or patches, e.g., for
+    receptive-field mapping.
+    The canvas is scaled to fit the target rectangle (or the screen)
+    just like the images of an ordinary STIMULUS, and the sprites are
+    scaled along with it.
+    The most important methods are:
+      - ADD_SPRITE - Add a sprite image
+      - SET_PLACEMENTS - Specify positions and opacities for all frames
+    Refresh rate, delays, and background color are set as for a STIMULUS.
+    The presentation order is simply one entry per row of the placement
+    table; SET_ORDER is not used.'''
+    def __init__(self, canvas_wh):
+        '''SPRITESTIMULUS - Construct an empty sprite stimulus
+        SPRITESTIMULUS((w, h)) constructs a sprite stimulus on a virtual
+        canvas of WxH pixels.'''
+        super().__init__()
+        self.canvas_wh = (canvas_wh[0], canvas_wh[1])
+        self.placements = np.zeros((0, 0, 4))
+        self.sprite_cache = {} # Scaled sprites, by ID, size, and smoothness
+
+    def add_sprite(self, img, label=None):
+        '''ADD_SPRITE - Add a sprite image
+        id = ADD_SPRITE(img) adds a sprite to our collection. IMG may be a
+        filename or a numpy array. Arrays may be HxW (grayscale), HxWx3
+        (RGB), or HxWx4 (RGBA, with an alpha channel for transparency).
+        Pixel values are interpreted as in ADD_IMAGE_FROM_ARRAY.
+        The returned ID is used in SET_PLACEMENTS.
+        Optional argument LABEL specifies a name for the sprite.'''
+        stimulus.Stimulus.app = qtapp.get_app()
+
+        if type(img)==str:
+            if label is None:
+                label = img
+            qimg = QImage(img)
+        else:
+            ar = img
+            if ar.dtype==np.uint8:
+                pass
+            elif np.issubdtype(ar.dtype, np.integer):
+                ar = ar.astype(np.uint8)
+            else:
+                ar = (255.99999*ar).astype(np.uint8)
+            ar = np.ascontiguousarray(ar)
+            shp = ar.shape
+            if len(shp)==3 and shp[2]==4:
+                h, w, _ = shp
+                qimg = QImage(ar.data, w, h, 4*w, QImage.Format_RGBA8888)
+            elif len(shp)==3 and shp[2]==3:
+                h, w, _ = shp
+                qimg = QImage(ar.data, w, h, 3*w, QImage.Format_RGB888)
+            elif len(shp)==2:
+                h, w = shp
+                qimg = QImage(ar.data, w, h, w, QImage.Format_Grayscale8)
+            else:
+                raise ValueError('Unacceptable shape of array')
+        # Converting also makes a copy that owns its data. QImages rather
+        # than QPixmaps are used, so that offline rendering can use them
+        # from worker threads.
+        qimg = qimg.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        if label is None:
+            label = f'{len(self.fns)}'
+        self._store(qimg)
+        self.fns.append(label)
+        self.sprite_cache.clear()
+        return len(self.fns) - 1
+
+    def set_placements(self, table):
+        '''SET_PLACEMENTS - Specify positions and opacities for all frames
+        SET_PLACEMENTS(table), where TABLE is an NxKx4 array, specifies
+        that in frame n, K sprites are drawn: for each, TABLE[n, k, :]
+        contains the sprite ID, the X and Y position of its top-left
+        corner on the canvas (in canvas pixels, not necessarily whole),
+        and its opacity (from 0 to 1). Sprites are drawn in order of K.
+        A negative sprite ID leaves the slot empty in that frame.
+        TABLE may also be Nx4 if there is only one sprite per frame.
+        The number of frames in the stimulus is N.'''
+        table = np.asarray(table, float)
+        if table.ndim==2:
+            table = table[:, np.newaxis, :]
+        if table.ndim != 3 or table.shape[2] != 4:
+            raise ValueError('Placement table must be NxKx4 or Nx4')
+        ids = table[:, :, 0]
+        if np.any(ids >= len(self.fns)):
+            raise ValueError('Placement table refers to unknown sprites')
+        self.placements = table
+
+    def presentation_order(self, f_Hz=None):
+        '''PRESENTATION_ORDER - Return presentation order
+        PRESENTATION_ORDER() returns a list of frame numbers, one for
+        each row of the placement table.'''
+        return list(range(len(self.placements)))
+
+    def memory_usage(self):
+        '''MEMORY_USAGE - Memory used by images and the placement table'''
+        return super().memory_usage() + self.placements.nbytes
+
+    def in_memory(self, k):
+        return False
+
+    def is_composite(self):
+        return True
+
+    def compose(self, k, target, smooth=False):
+        '''COMPOSE - Layers that make up a frame
+        layers = COMPOSE(k, target) returns a list of (img, x, y, opacity)
+        tuples, one for each sprite visible in frame K, scaled and placed
+        for the given TARGET rectangle. Sprites are cut off at the edges
+        of the canvas. See RENDER.PAINT_FRAME.'''
+        x0, y0, sw, sh, rat = geometry.fit(self.canvas_wh, target)
+        canvas = QRect(*geometry.fit_pixels(self.canvas_wh, target))
+        layers = []
+        for sid, x, y, opacity in self.placements[k]:
+            if sid < 0 or not opacity > 0:
+                continue
+            img = self._scaled_sprite(int(sid), rat, smooth)
+            if img is None:
+                continue
+            # Sprites may start left of or above the canvas: round down
+            left = math.floor(x0 + x * rat)
+            top = math.floor(y0 + y * rat)
+            rect = QRect(left, top, img.width(), img.height())
+            if not canvas.contains(rect):
+                # Only draw the part that falls on the canvas
+                rect = rect.intersected(canvas)
+                if rect.isEmpty():
+                    continue
+                img = img.copy(rect.translated(-left, -top))
+            layers.append((img, rect.x(), rect.y(), min(opacity, 1)))
+        return layers
+
+    def _scaled_sprite(self, sid, rat, smooth):
+        img = self.images[sid]
+        sw = int(img.width() * rat)
+        sh = int(img.height() * rat)
+        key = (sid, sw, sh, smooth)
+        if key not in self.sprite_cache:
+            if sw <= 0 or sh <= 0:
+                res = None
+            else:
+                res = img.scaled(sw, sh, Qt.IgnoreAspectRatio,
+                                 Qt.SmoothTransformation if smooth
+                                 else Qt.FastTransformation)
+            self.sprite_cache[key] = res
+        return self.sprite_cache[key]
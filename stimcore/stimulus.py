@@ -1,14 +1,54 @@
 #!/usr/bin/python3
 
 import numpy as np
-from PyQt5.QtGui import QPixmap, QImage
+import hashlib
+import os
+import time
+import concurrent.futures
+from PyQt5.QtGui import QImage
 from PyQt5.QtWidgets import QApplication
+from . import imagecache
+from . import bundle
+from . import render
+from . import orders
+from . import qtapp
+
+def _compact(img):
+    '''Convert a QImage to the most compact format that holds it'''
+    if img.isNull():
+        return img
+    if img.hasAlphaChannel():
+        # Transparent pixels must still show the background when painted
+        if img.format() != QImage.Format_ARGB32_Premultiplied:
+            img = img.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    elif img.isGrayscale():
+        if img.format() != QImage.Format_Grayscale8:
+            img = img.convertToFormat(QImage.Format_Grayscale8)
+    elif not img.hasAlphaChannel():
+        if img.format() != QImage.Format_RGB888:
+            img = img.convertToFormat(QImage.Format_RGB888)
+    return img
+
+
+def _load_compact(fn):
+    return _compact(QImage(fn))
+
+
+def _report_progress(done, total, t):
+    if done < total and done % 100 != 0:
+        return
+    rate = done / t if t > 0 else 0
+    end = '\n' if done==total else ''
+    print(f'\rDecoded {done}/{total} images in {t:.1f} s'
+          f' ({rate:.1f} images/s)', end=end, flush=True)
+
 
 class Stimulus:
     '''Class STIMULUS: A sequence of images with extra information
     The most important methods are:
       - ADD_IMAGE - Add an image to the sequence from file or numpy array
       - SET_ORDER - Specify the order of image presentation
+      - SET_TIMED_ORDER - Specify the order with a duration for each image
       - SET_REFRESH_RATE - Set rate of image presentation    
       - SET_INITIAL_DELAY - Specify delay before first image
       - SET_FINAL_DELAY - Specify delay after final image
@@ -16,21 +56,58 @@ class Stimulus:
 
     Less frequently used methods are:
       - ADD_IMAGE_FROM_FILE - Add an image to the list from a file
+      - ADD_IMAGES_FROM_FILES - Add many images at once from files
       - ADD_IMAGE_FROM_ARRAY - Add an image to the list from an array
+      - ADD_IMAGES - Add many images at once from an array
+      - ADD_IMAGE_STACK - Add many images at once from an array or .npy file
       - RESET_ORDER - Reset order of image presentation
       - PRESENTATION_ORDER - Return presentation order
       - GET_IMAGE - Retrieve an image from the list
+      - SCALE_IMAGE - Retrieve an image scaled to fit a target rectangle
       - IMAGE_NAME - Retrieve the filename or alternative label for an image
       - FIND_IMAGE_BY_NAME - Find the ID of an image given its name
+      - PREFETCH - Decode images ahead of time (lazy stimuli only)
+      - MEMORY_USAGE - Memory used by decoded images
+      - SAVE_BUNDLE - Save the whole stimulus to a single file
+      - LOAD_BUNDLE - Load a stimulus saved with SAVE_BUNDLE
 
     This class is completely passive (it merely stores the images). The
     actual presentation of a stimulus sequence is the responsibility of
     the DISPLAY class.'''
     app = QApplication.instance()
-    def __init__(self):
+    def __init__(self, lazy=False, cache_mb=512, budget_mb=None):
+        '''STIMULUS - Construct an empty stimulus sequence
+        STIMULUS() constructs a stimulus sequence that holds all its
+        images in memory. Images are held in their most compact format
+        (8 bits per pixel for grayscale images, 24 for color images,
+        and 32 for images with transparency); the display converts them
+        to the screen's format only as they are needed.
+        STIMULUS(lazy=True) constructs a stimulus sequence that only
+        records the filenames of images added with ADD_IMAGE_FROM_FILE
+        and decodes them when they are needed. At most CACHE_MB megabytes
+        of decoded images (in the same compact formats) are kept in
+        memory at any time. This makes it
+        possible to present sequences that do not fit in memory.
+        Optional argument BUDGET_MB limits the memory used by images held
+        in memory (see MEMORY_USAGE). Adding an image that would exceed
+        the limit raises an exception. The display's copies of images
+        scaled to their on-screen size are not included (see
+        DISPLAY.MEMORY_USAGE).'''
         self.fns = []
         self.order = None
-        self.pixmaps = []
+        self.images = [] # QImages, filenames for lazily loaded images,
+                         # or (stack, index) pairs for image stacks
+        self.nbytes = 0 # Memory used by QImages in IMAGES
+        self.budget = None
+        if budget_mb is not None:
+            self.budget = int(budget_mb * 1024 * 1024)
+        self.same_as = {} # Maps IDs of duplicate images to original IDs
+        self.hashes = {} # Maps content hashes to IDs, see ADD_IMAGES
+        self.cache = None
+        self.prescaled = None # Target, scaling mode, and image positions,
+                              # for images pre-scaled by SAVE_BUNDLE
+        if lazy:
+            self.cache = imagecache.ImageCache(self._load_image, cache_mb)
         self.f_Hz = 10
         self.initial_delay_s = 0
         self.final_delay_s = 0
@@ -58,17 +135,61 @@ class Stimulus:
         be used in SET_ORDER. IDs count up from zero, so you can also 
         keep count yourself.
         Optional argument LABEL uses something other than the filename
-        as the name for the image.'''
-        Stimulus.app = QApplication.instance()
-        if Stimulus.app is None:
-            Stimulus.app = QApplication(['stimcore'])
+        as the name for the image.
+        For a lazy stimulus, the file is not read until the image is
+        needed.'''
+        Stimulus.app = qtapp.get_app()
 
         if label is None:
             label = fn
+        if self.cache is None:
+            self._store(_compact(QImage(fn)))
+        else:
+            self.images.append(fn)
         self.fns.append(label)
-        self.pixmaps.append(QPixmap(fn))
         return len(self.fns) - 1
 
+    def add_images_from_files(self, fns, labels=None, workers=None,
+                              progress=True):
+        '''ADD_IMAGES_FROM_FILES - Add many images at once from files
+        ids = ADD_IMAGES_FROM_FILES(fns) adds the images in all the files
+        in the list FNS to our collection, as ADD_IMAGE_FROM_FILE, but
+        decodes them in parallel in a pool of worker threads. Images get
+        their IDs in the order of FNS, which are returned as a list.
+        Optional argument LABELS specifies names for the images. By
+        default, their filenames are used as names.
+        Optional argument WORKERS specifies the number of worker threads.
+        By default, one per CPU core is used.
+        Optional argument PROGRESS, if True (the default), reports
+        progress and decoding throughput on stdout. It may also be a
+        function, which is called as PROGRESS(done, total, t) after each
+        image, where DONE is the number of images decoded so far, TOTAL
+        the number of files, and T the time elapsed in seconds.
+        For a lazy stimulus, nothing is decoded, so this is the same as
+        calling ADD_IMAGE_FROM_FILE for each file.'''
+        Stimulus.app = qtapp.get_app()
+
+        if labels is None:
+            labels = fns
+        if self.cache is not None:
+            return [self.add_image_from_file(fn, label)
+                    for fn, label in zip(fns, labels)]
+        if progress is True:
+            progress = _report_progress
+        if workers is None:
+            workers = os.cpu_count() or 1
+        N = len(fns)
+        ids = []
+        t0 = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            for n, img in enumerate(pool.map(_load_compact, fns)):
+                self._store(img)
+                self.fns.append(labels[n])
+                ids.append(len(self.fns) - 1)
+                if progress:
+                    progress(n + 1, N, time.perf_counter() - t0)
+        return ids
+
     def add_image_from_array(self, ar, label=None):
         '''ADD_IMAGE_FROM_ARRAY - Add an image to the list
         id = ADD_IMAGE_FROM_ARRAY(ar) adds an image to our collection
@@ -79,9 +200,7 @@ class Stimulus:
         values must be between 0.0 (black) and 1.0 (white).
         Optional argument LABEL specifies a name for the image in lieu
         of a filename. By default, its numeric ID is used as a name.'''
-        Stimulus.app = QApplication.instance()
-        if Stimulus.app is None:
-            Stimulus.app = QApplication(['stimcore'])
+        Stimulus.app = qtapp.get_app()
         
         isint = np.issubdtype(ar.dtype, np.integer)
         if ar.dtype==np.uint8:
@@ -100,20 +219,170 @@ class Stimulus:
             img = QImage(ar.data, w, h, w, QImage.Format_Grayscale8)
         else:
             raise ValueError('Unacceptable shape of array')
+        self._store(img.copy()) # The copy owns its data
         if label is None:
             label = f'{len(self.fns)}'
         self.fns.append(label)
-        self.pixmaps.append(QPixmap(img))            
         return len(self.fns) - 1
     
-    def set_order(self, order):
+    def add_images(self, stack, labels=None, dedupe=False):
+        '''ADD_IMAGES - Add many images at once
+        ids = ADD_IMAGES(stack) adds all the images in an NxHxW (grayscale)
+        or NxHxWx3 (RGB) array to our collection. Pixel values are
+        interpreted as in ADD_IMAGE_FROM_ARRAY, but conversion is done
+        for the whole stack at once.
+        Optional argument LABELS specifies names for the images. By
+        default, their numeric IDs are used as names.
+        Optional argument DEDUPE, if True, makes images with identical
+        contents share storage, even across calls to ADD_IMAGES. Each
+        image still gets its own ID and label.
+        The result is a list of image IDs.'''
+        Stimulus.app = qtapp.get_app()
+
+        shp = stack.shape
+        if len(shp)==4 and shp[3]==3:
+            N, h, w, _ = shp
+            fmt = QImage.Format_RGB888
+            bpl = 3*w
+        elif len(shp)==3:
+            N, h, w = shp
+            fmt = QImage.Format_Grayscale8
+            bpl = w
+        else:
+            raise ValueError('Unacceptable shape of array')
+        if stack.dtype==np.uint8:
+            stack = np.ascontiguousarray(stack)
+        elif np.issubdtype(stack.dtype, np.integer):
+            stack = stack.astype(np.uint8)
+        else:
+            stack = (255.99999*stack).astype(np.uint8)
+        
+        ids = []
+        for k in range(N):
+            if labels is None:
+                label = f'{len(self.fns)}'
+            else:
+                label = labels[k]
+            ar = stack[k]
+            orig = None
+            if dedupe:
+                hsh = hashlib.blake2b(ar.data, digest_size=16).digest()
+                hsh = (hsh, shp[1:])
+                orig = self.hashes.get(hsh)
+            if orig is None:
+                self._store(QImage(ar.data, w, h, bpl, fmt).copy())
+                if dedupe:
+                    self.hashes[hsh] = len(self.fns)
+            else:
+                self.images.append(self.images[orig])
+                self.same_as[len(self.fns)] = orig
+            self.fns.append(label)
+            ids.append(len(self.fns) - 1)
+        return ids
+
+    def add_image_stack(self, stack, labels=None):
+        '''ADD_IMAGE_STACK - Add many images at once
+        ids = ADD_IMAGE_STACK(stack) adds all the images in an NxHxW
+        (grayscale) or NxHxWx3 (RGB) array of type uint8 to our collection.
+        STACK may also be the filename of a .npy file, which is then
+        opened read-only as a memory map.
+        The images are not copied: each image is presented directly
+        from the array, so a memory-mapped stack only uses the operating
+        system's page cache, however large it is. For that, the array
+        must be C-contiguous; use np.ascontiguousarray to copy other
+        arrays (e.g., slices) explicitly.
+        Optional argument LABELS specifies names for the images. By
+        default, their numeric IDs are used as names.
+        The result is a list of image IDs.'''
+        if type(stack)==str:
+            stack = np.load(stack, mmap_mode='r')
+        if stack.dtype != np.uint8:
+            raise ValueError('Image stack must be of type uint8')
+        shp = stack.shape
+        if not (len(shp)==3 or (len(shp)==4 and shp[3]==3)):
+            raise ValueError('Unacceptable shape of array')
+        if not stack.flags.c_contiguous:
+            # Copying would read all of a memory-mapped stack into memory
+            raise ValueError('Image stack must be C-contiguous')
+        ids = []
+        for k in range(shp[0]):
+            if labels is None:
+                label = f'{len(self.fns)}'
+            else:
+                label = labels[k]
+            self.fns.append(label)
+            self.images.append((stack, k))
+            ids.append(len(self.fns) - 1)
+        return ids
+    
+    def save_bundle(self, path, target=None, smooth=False):
+        '''SAVE_BUNDLE - Save the whole stimulus to a single file
+        SAVE_BUNDLE(path) saves the decoded images along with their
+        labels, the presentation order, refresh rate, delays, and
+        background color to a single file, from which LOAD_BUNDLE can
+        quickly restore the stimulus.
+        Optional argument TARGET, an (x,y,w,h)-quad in pixels, pre-scales
+        the images to their size when shown in that target rectangle
+        (use the full screen rectangle if you do not use a target), so
+        that no scaling is needed at presentation time either. Optional
+        argument SMOOTH is as for DISPLAY.RUN.'''
+        bundle.save(self, path, target, smooth)
+
+    @staticmethod
+    def load_bundle(path):
+        '''LOAD_BUNDLE - Load a stimulus saved with SAVE_BUNDLE
+        stim = Stimulus.load_bundle(path) constructs a new stimulus from
+        a file written by SAVE_BUNDLE. The file is memory-mapped rather
+        than read, so this is almost instantaneous, however large the
+        file. Images are presented directly from the memory map, as for
+        ADD_IMAGE_STACK.'''
+        stim = Stimulus()
+        bundle.load(stim, path)
+        return stim
+
+    def set_order(self, order, length=None):
         '''SET_ORDER - Specify the order of image presentation
         SET_ORDER(order), where ORDER is a list of image IDs (as returned
         by ADD_IMAGE) specifies the order of presentation. If no order
         is specified in this way, the default is to present each image
-        once in the order they were added.'''
+        once in the order they were added.
+        ORDER may also be a 1-D numpy array of integers, which takes far
+        less memory than a list for long sessions.
+        SET_ORDER(gen, length), where GEN is an iterable that is not a
+        list, such as a generator, specifies an order of LENGTH frames
+        that is produced on demand: the display only reads a few frames
+        ahead of the one it is showing. See ORDERS.BLOCK_RANDOM and
+        ORDERS.MSEQUENCE for useful generators. The order that was
+        actually shown is recorded in the IMAGE field of the frames
+        of LAST_RUN_TIMING; showing the stimulus again repeats it.'''
+        if isinstance(order, np.ndarray):
+            if order.ndim != 1 or not np.issubdtype(order.dtype, np.integer):
+                raise ValueError('Order must be a 1-D array of integers')
+        elif not hasattr(order, '__len__') or not hasattr(order,
+                                                          '__getitem__'):
+            if length is None:
+                raise ValueError('Length must be specified for a generator')
+            order = orders.Stream(order, length)
         self.order = order
         
+    def set_timed_order(self, entries, unit='frames'):
+        '''SET_TIMED_ORDER - Specify the order with a duration for each image
+        SET_TIMED_ORDER(entries), where ENTRIES is a list of (id, duration)
+        pairs, specifies an order of presentation in which each image is
+        held for the given number of frames. This is equivalent to
+        repeating each ID that many times in SET_ORDER, but takes less
+        memory, and the display does not repaint the image while it is
+        held. Photodiodes and GPIOs still follow the frame rate.
+        Optional argument UNIT may be "s" to specify durations in seconds
+        rather than frames. They are then rounded to whole frames at the
+        rate at which the display actually presents the stimulus (see
+        DISPLAY.FRAME_RATE), which in vsync mode may differ slightly from
+        the refresh rate set with SET_REFRESH_RATE.'''
+        entries = list(entries)
+        ids = [e[0] for e in entries]
+        durations = [e[1] for e in entries]
+        self.order = orders.RunLength(ids, durations, unit)
+
     def reset_order(self):
         '''RESET_ORDER - Reset order of image presentation
         RESET_ORDER() resets the order of image presentation to a single
@@ -126,20 +395,122 @@ class Stimulus:
         the given frame rate, expressed in Hertz.'''
         self.f_Hz = f_Hz
 
-    def presentation_order(self):
+    def presentation_order(self, f_Hz=None):
         '''PRESENTATION_ORDER - Return presentation order
         PRESENTATION_ORDER() returns the order of presentation as a list
-        of image IDs.'''
+        of image IDs, one per frame. For an order specified with
+        SET_TIMED_ORDER, the result is an ORDERS.RUNLENGTH, which
+        behaves like such a list.
+        Optional argument F_HZ specifies the frame rate at which durations
+        in seconds are converted to frames. Default is the refresh rate
+        set with SET_REFRESH_RATE.'''
+        if f_Hz is None:
+            f_Hz = self.f_Hz
         if self.order is None:
             return list(range(len(self.fns)))
+        elif isinstance(self.order, orders.RunLength):
+            return self.order.in_frames(f_Hz)
         else:
             return self.order
 
     def get_image(self, k):
         '''GET_IMAGE - Retrieve an image from the list
         GET_IMAGE(id), where ID is an ID as returned by ADD_IMAGE,
-        returns the corresponding image as a QPixmap.'''
-        return self.pixmaps[k]
+        returns the corresponding image as a QImage.'''
+        img = self.images[k]
+        if type(img)==str:
+            return self.cache.get(k)
+        elif type(img)==tuple:
+            stack, n = img
+            ar = stack[n]
+            shp = ar.shape
+            if len(shp)==3 and shp[2]==4:
+                # Alpha images from bundles, as ARGB32 words
+                h, w, _ = shp
+                return QImage(ar.data, w, h, 4*w,
+                              QImage.Format_ARGB32_Premultiplied)
+            elif len(shp)==3:
+                h, w, _ = shp
+                return QImage(ar.data, w, h, 3*w, QImage.Format_RGB888)
+            else:
+                h, w = shp
+                return QImage(ar.data, w, h, w, QImage.Format_Grayscale8)
+        return img
+
+    def scale_image(self, k, target, smooth=False):
+        '''SCALE_IMAGE - Retrieve an image scaled to fit a target rectangle
+        (img, x, y) = SCALE_IMAGE(id, target) returns the image with the
+        given ID scaled to fit the TARGET rectangle, along with the
+        position of its top-left corner, as RENDER.SCALE_IMAGE.
+        For images that SAVE_BUNDLE pre-scaled for the same target and
+        scaling mode, no scaling is done.'''
+        pre = self.prescaled
+        if (pre is not None and tuple(target)==pre['target']
+                and bool(smooth)==pre['smooth']):
+            img = self.get_image(k)
+            if img.width()<=0 or img.height()<=0:
+                return (None, 0, 0)
+            x, y = pre['positions'][k]
+            return (img, x, y)
+        return render.scale_image(self.get_image(k), target, smooth)
+
+    def original_id(self, k):
+        '''ORIGINAL_ID - ID of the image that shares storage with an image
+        ORIGINAL_ID(id) returns the ID of the first image that was found
+        to be identical to the image with the given ID by ADD_IMAGES, or
+        the ID itself if the image is not a duplicate.'''
+        return self.same_as.get(k, k)
+
+    def in_memory(self, k):
+        '''IN_MEMORY - Whether an image is held decoded in memory
+        IN_MEMORY(id) returns True if the image with the given ID is
+        held in memory, or False if it is loaded lazily or read from
+        an image stack when needed.'''
+        return type(self.images[k])!=str and type(self.images[k])!=tuple
+
+    def memory_usage(self):
+        '''MEMORY_USAGE - Memory used by decoded images
+        MEMORY_USAGE() returns the number of bytes used by the images
+        that are held in memory, including, for a lazy stimulus, the
+        images in its cache. Images that share storage are counted
+        once. Images from (memory-mapped) image stacks are not counted.
+        A display additionally keeps up to 256 MB of images scaled to
+        their on-screen size; see DISPLAY.MEMORY_USAGE and
+        DISPLAY.SET_SCALED_CACHE.'''
+        nbytes = self.nbytes
+        if self.cache is not None:
+            nbytes += self.cache.nbytes
+        return nbytes
+
+    def _store(self, img):
+        nbytes = img.sizeInBytes()
+        if self.budget is not None and self.nbytes + nbytes > self.budget:
+            raise ValueError(f'Image would exceed the memory budget of '
+                             f'{self.budget/1024/1024:.1f} MB')
+        self.nbytes += nbytes
+        self.images.append(img)
+
+    def is_composite(self):
+        '''IS_COMPOSITE - Whether frames are composed at paint time
+        IS_COMPOSITE() returns False for an ordinary stimulus, whose
+        frames are images from the list. Stimulus types whose frames are
+        composed while they are painted (e.g., SPRITES.SPRITESTIMULUS)
+        return True, and implement COMPOSE(k, target, smooth), which
+        returns a list of (img, x, y, opacity) layers for frame K.'''
+        return False
+
+    def prefetch(self, ids):
+        '''PREFETCH - Decode images ahead of time
+        PREFETCH(ids) arranges for the images with the given IDs to be
+        decoded in the background, so that a subsequent GET_IMAGE does
+        not have to wait for them. This does nothing for images that
+        are already held in memory.'''
+        if self.cache is not None:
+            self.cache.prefetch([k for k in ids
+                                 if type(self.images[k])==str])
+
+    def _load_image(self, k):
+        return _load_compact(self.images[k])
 
     def image_name(self, k):
         '''IMAGE_NAME - Retrieve the filename or alternative label for an image
@@ -0,0 +1,23 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+def plan(nframes, signals):
+    '''PLAN - State of periodic sync signals in every frame
+    on = PLAN(nframes, signals), where SIGNALS is a list of objects with
+    PERIOD and DELAY members (such as the photodiodes and GPIOs of a
+    DISPLAY), returns an NFRAMES x NSIGNALS boolean array that is True
+    where a signal is on. Signal n is on in frame k if k ≥ DELAY and
+    k - DELAY is a multiple of PERIOD.'''
+    k = np.arange(nframes).reshape(-1, 1)
+    period = np.array([s.period for s in signals], int).reshape(1, -1)
+    delay = np.array([s.delay for s in signals], int).reshape(1, -1)
+    return (k >= delay) & ((k - delay) % period == 0)
+
+def to_bits(on):
+    '''TO_BITS - Combine sync signal states into bit masks
+    bits = TO_BITS(on), where ON is as returned by PLAN, returns a
+    vector with one integer per frame in which bit n is set if
+    signal n is on.'''
+    weights = 1 << np.arange(on.shape[1], dtype=np.uint32)
+    return (on * weights).sum(1).astype(np.uint32)
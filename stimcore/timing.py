@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+import numpy as np
+from . import sync
+from . import orders
+
+# One record per frame. All times are in seconds since the start of the run.
+#   block - position of the stimulus in a playlist (zero for a single run)
+#   k - frame number (within the block)
+#   image - ID of the image shown
+#   scheduled - time at which the frame should have appeared
+#   fired - time at which the timer fired for the frame
+#   painted - time at which the frame was first painted (NaN if never)
+#   swapped - time at which the frame reached the screen, for displays
+#             that are locked to the monitor refresh (NaN otherwise)
+#   sync - state of the sync signals while the frame was shown: bit n
+#          is photodiode n, followed by one bit per GPIO (see SYNC.PLAN).
+FRAME_DTYPE = np.dtype([('block', np.int32),
+                        ('k', np.int32),
+                        ('image', np.int32),
+                        ('scheduled', np.float64),
+                        ('fired', np.float64),
+                        ('painted', np.float64),
+                        ('swapped', np.float64),
+                        ('sync', np.uint32)])
+
+
+class RunTiming:
+    '''Class RUNTIMING: Per-frame timing record of a stimulus run
+    A RUNTIMING is produced by DISPLAY.RUN and retrieved with
+    DISPLAY.LAST_RUN_TIMING. Its FRAMES member is a structured numpy
+    array with fields BLOCK, K, IMAGE, SCHEDULED, FIRED, PAINTED, SWAPPED,
+    and SYNC; see FRAME_DTYPE for details.
+    For a playlist, the records of all blocks are concatenated (see
+    CONCATENATE), and F_HZ has one entry per frame.
+    The most important methods are:
+      - SUMMARY - Summary statistics of the frame timing
+      - DROPPED - Frames that missed their deadline'''
+
+    def __init__(self, order, f_Hz, initial_delay_s=0, sync_plan=None,
+                 block=0):
+        '''RUNTIMING - Prepare a timing record
+        RUNTIMING(order, f_Hz) prepares a record for a run that presents
+        images in the given ORDER at F_HZ frames per second. If ORDER
+        is an ORDERS.STREAM, image IDs are filled in as frames are shown
+        (see RECORD_IMAGE).
+        Optional argument INITIAL_DELAY_S specifies the delay before the
+        first frame.
+        Optional argument SYNC_PLAN specifies the state of the sync
+        signals in each frame, as returned by SYNC.PLAN.
+        Optional argument BLOCK specifies the position of the stimulus
+        in a playlist.'''
+        N = len(order)
+        self.f_Hz = f_Hz
+        if sync_plan is None:
+            sync_plan = np.zeros((N, 0), bool)
+        self.sync_plan = sync_plan
+        self.frames = np.zeros(N, FRAME_DTYPE)
+        self.frames['block'] = block
+        self.frames['k'] = np.arange(N)
+        if isinstance(order, orders.Stream):
+            self.frames['image'] = -1 # Filled in by RECORD_IMAGE
+        else:
+            self.frames['image'] = order
+        self.frames['scheduled'] = initial_delay_s + np.arange(N) / f_Hz
+        self.frames['fired'] = np.nan
+        self.frames['painted'] = np.nan
+        self.frames['swapped'] = np.nan
+        self.frames['sync'] = sync.to_bits(sync_plan)
+
+    def record_image(self, k, imgid):
+        '''RECORD_IMAGE - Record the image shown in a frame'''
+        self.frames['image'][k] = imgid
+
+    def record_fire(self, k, t):
+        '''RECORD_FIRE - Record the time at which the timer fired'''
+        self.frames['fired'][k] = t
+
+    def record_paint(self, k, t):
+        '''RECORD_PAINT - Record the time at which a frame was painted'''
+        self.frames['painted'][k] = t
+
+    def record_swap(self, k, t):
+        '''RECORD_SWAP - Record the time at which a frame reached the screen'''
+        self.frames['swapped'][k] = t
+
+    def shown(self):
+        '''SHOWN - Times at which frames appeared
+        SHOWN() returns the swap times of all frames if they were
+        recorded, or else their paint times.'''
+        if np.any(np.isfinite(self.frames['swapped'])):
+            return self.frames['swapped']
+        return self.frames['painted']
+
+    def intervals(self):
+        '''INTERVALS - Intervals between successive frames
+        INTERVALS() returns the intervals between the times at which
+        successive frames appeared (see SHOWN), in seconds.'''
+        return np.diff(self.shown())
+
+    def dropped(self, tolerance=0.5):
+        '''DROPPED - Frames that missed their deadline
+        DROPPED() returns the frame numbers of frames that appeared
+        (see SHOWN) more than half a frame period after their scheduled
+        time, or that were not shown at all.
+        Optional argument TOLERANCE specifies the allowed lateness as
+        a fraction of a frame period.'''
+        late = self.shown() - self.frames['scheduled']
+        bad = ~(late <= tolerance / self.f_Hz)
+        return self.frames['k'][bad]
+
+    def summary(self, tolerance=0.5):
+        '''SUMMARY - Summary statistics of the frame timing
+        SUMMARY() returns a dict with the number of frames, the total
+        duration from first to last frame, the mean, standard deviation,
+        minimum, and maximum of the frame intervals, the mean and maximum
+        lateness relative to schedule, and the number of dropped frames
+        (see DROPPED). Times are in seconds.'''
+        dt = self.intervals()
+        dt = dt[np.isfinite(dt)]
+        late = self.shown() - self.frames['scheduled']
+        late = late[np.isfinite(late)]
+        if len(dt)==0:
+            dt = np.array([np.nan])
+        if len(late)==0:
+            late = np.array([np.nan])
+        return {'frames': len(self.frames),
+                'duration': float(np.sum(dt)),
+                'interval_mean': float(np.mean(dt)),
+                'interval_std': float(np.std(dt)),
+                'interval_min': float(np.min(dt)),
+                'interval_max': float(np.max(dt)),
+                'lateness_mean': float(np.mean(late)),
+                'lateness_max': float(np.max(late)),
+                'dropped': len(self.dropped(tolerance))}
+
+    def save(self, fn):
+        '''SAVE - Save the timing record to a file
+        SAVE(fn) saves the per-frame records as FRAMES, the sync plan
+        as SYNC_PLAN, and the frame rate as F_HZ to a .npz file.'''
+        np.savez(fn, frames=self.frames, sync_plan=self.sync_plan,
+                 f_Hz=self.f_Hz)
+
+    def __repr__(self):
+        s = self.summary()
+        return (f'<RunTiming: {s["frames"]} frames, '
+                f'{1e3*s["interval_mean"]:.2f} ± '
+                f'{1e3*s["interval_std"]:.2f} ms, '
+                f'{s["dropped"]} dropped>')
+
+
+def concatenate(timings):
+    '''CONCATENATE - Combine the timing records of several blocks
+    t = CONCATENATE([t1, t2, ...]) combines the RUNTIMINGs of the blocks
+    of a playlist into one. The F_HZ member of the result has one entry
+    per frame.'''
+    res = RunTiming([], 1)
+    res.frames = np.concatenate([t.frames for t in timings])
+    res.f_Hz = np.concatenate([np.full(len(t.frames), t.f_Hz, float)
+                               for t in timings])
+    res.sync_plan = np.concatenate([t.sync_plan for t in timings])
+    return res
+
+
+def combine(timings):
+    '''COMBINE - Combine the timing records of screens shown in lockstep
+    t = COMBINE([t1, t2, ...]) combines the RUNTIMINGs of the screens of
+    a DISPLAYGROUP into one. The FIRED, PAINTED, and SWAPPED times of
+    each frame are the latest among the screens, i.e., the times at
+    which the frame was complete on all screens; a frame that was not
+    shown on some screen counts as not shown. The IMAGE field is taken
+    from the first screen. The sync plan holds the signals of all
+    screens, one after the other. The records of the individual screens
+    are kept in the SCREENS member.'''
+    res = RunTiming([], 1)
+    res.frames = timings[0].frames.copy()
+    for field in ('fired', 'painted', 'swapped'):
+        res.frames[field] = np.max([t.frames[field] for t in timings], 0)
+    res.f_Hz = timings[0].f_Hz
+    res.sync_plan = np.concatenate([t.sync_plan for t in timings], 1)
+    res.frames['sync'] = sync.to_bits(res.sync_plan)
+    res.screens = list(timings)
+    return res
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# Run without a screen unless told otherwise
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stimcore import display
+
+
+@pytest.fixture
+def disp():
+    '''A small window, reset for every test'''
+    return display.get_display(full_screen=False)
@@ -0,0 +1,75 @@
+import numpy as np
+from PyQt5.QtGui import QImage
+from stimcore import stimulus, render
+
+
+def make_stimulus():
+    rng = np.random.default_rng(1)
+    stim = stimulus.Stimulus()
+    stim.add_images(rng.integers(0, 256, (3, 30, 41, 3), np.uint8))
+    stim.add_images(rng.integers(0, 256, (2, 17, 23), np.uint8))
+    stim.add_images(np.zeros((3, 10, 10), np.uint8), dedupe=True)
+    stim.add_image_stack(rng.integers(0, 256, (2, 9, 7), np.uint8))
+    stim.set_order([0, 3, 5, 6, 7, 8, 9, 1])
+    stim.set_refresh_rate(60)
+    stim.set_background([10, 20, 30])
+    stim.set_initial_delay(0.1)
+    return stim
+
+
+def test_round_trip(tmp_path):
+    stim = make_stimulus()
+    fn = str(tmp_path / 'stim.bundle')
+    stim.save_bundle(fn)
+    stim2 = stimulus.Stimulus.load_bundle(fn)
+    assert list(stim2.presentation_order()) == stim.order
+    assert isinstance(stim2.order, np.ndarray) # Not read into a list
+    assert stim2.fns == stim.fns
+    assert stim2.f_Hz == stim.f_Hz
+    assert list(stim2.background) == stim.background
+    assert stim2.initial_delay_s == stim.initial_delay_s
+    assert stim2.same_as == stim.same_as
+    a = render.render(stim, (200, 100))
+    b = render.render(stim2, (200, 100))
+    assert np.array_equal(a, b)
+
+
+def test_prescaled(tmp_path):
+    stim = make_stimulus()
+    target = [10, 10, 120, 80]
+    fn = str(tmp_path / 'stim.bundle')
+    stim.save_bundle(fn, target)
+    stim2 = stimulus.Stimulus.load_bundle(fn)
+    a = render.render(stim, (200, 100), target)
+    b = render.render(stim2, (200, 100), target)
+    assert np.array_equal(a, b)
+
+
+def test_timed_order(tmp_path):
+    stim = make_stimulus()
+    stim.set_timed_order([(0, 0.1), (1, 0.05)], unit='s')
+    fn = str(tmp_path / 'stim.bundle')
+    stim.save_bundle(fn)
+    stim2 = stimulus.Stimulus.load_bundle(fn)
+    assert list(stim2.presentation_order()) == [0] * 6 + [1] * 3
+
+
+def test_alpha(tmp_path):
+    rng = np.random.default_rng(2)
+    rgba = rng.integers(0, 256, (12, 15, 4), np.uint8)
+    rgba[:, :6, 3] = 0 # Transparent on the left
+    img = QImage(rgba.data, 15, 12, 4*15, QImage.Format_RGBA8888)
+    fn = str(tmp_path / 'alpha.png')
+    img.save(fn)
+    stim = stimulus.Stimulus()
+    stim.add_image_from_file(fn)
+    stim.set_order([0])
+    stim.set_background([200, 50, 0])
+    bfn = str(tmp_path / 'stim.bundle')
+    stim.save_bundle(bfn)
+    stim2 = stimulus.Stimulus.load_bundle(bfn)
+    assert stim2.get_image(0).hasAlphaChannel()
+    a = render.render(stim, (40, 30))
+    b = render.render(stim2, (40, 30))
+    assert np.array_equal(a, b)
+    assert list(b[0, 15, 5]) == [200, 50, 0]
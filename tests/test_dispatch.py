@@ -0,0 +1,22 @@
+import time
+from stimcore import dispatch
+
+
+def test_flush_waits_for_callbacks():
+    done = []
+    def slow(k, t):
+        time.sleep(0.01)
+        done.append(k)
+    d = dispatch.Dispatcher()
+    d.add(slow)
+    d.set_threaded(True)
+    for k in range(5):
+        d.notify(k, 0)
+    d.flush()
+    assert done == [0, 1, 2, 3, 4]
+    thread = d.thread
+    d.stop()
+    assert d.thread is None and not thread.is_alive()
+    d.notify(5, 0) # Starts a new worker
+    d.stop()
+    assert done[-1] == 5
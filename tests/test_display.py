@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from stimcore import stimulus, playlist, orders
+
+
+def make_stimulus(order, length=None):
+    stim = stimulus.Stimulus()
+    for v in (0.0, 0.5, 1.0):
+        stim.add_image_from_array(np.full((8, 8), v))
+    stim.set_refresh_rate(60)
+    stim.set_order(order, length)
+    return stim
+
+
+def test_run(disp):
+    stim = make_stimulus([0, 1, 2, 1])
+    disp.add_photodiode((0, 0, 10, 10))
+    disp.run(stim)
+    frames = disp.last_run_timing().frames
+    assert list(frames['image']) == [0, 1, 2, 1]
+    assert not np.any(np.isnan(frames['painted']))
+
+
+def test_playlist(disp):
+    stims = [make_stimulus([0, 1, 2]), make_stimulus([2, 2]),
+             make_stimulus(orders.RunLength([1, 0], [2, 1]))]
+    pl = playlist.Playlist()
+    for stim in stims:
+        pl.add(stim)
+    disp.run_playlist(pl)
+    frames = disp.last_run_timing().frames
+    assert list(frames['block']) == [0, 0, 0, 1, 1, 2, 2, 2]
+    assert list(frames['image']) == [0, 1, 2, 2, 2, 1, 1, 0]
+    assert not np.any(np.isnan(frames['painted']))
+    assert np.all(np.diff(frames['painted']) > 0)
+
+
+def test_timed_order_uses_frame_rate(disp, monkeypatch):
+    # As in vsync mode, where the display's rate differs from F_HZ
+    monkeypatch.setattr(disp._disp, 'frame_rate', lambda stim=None: 50)
+    stim = make_stimulus([0])
+    stim.set_timed_order([(0, 0.1), (1, 0.1)], unit='s')
+    disp.run(stim)
+    frames = disp.last_run_timing().frames
+    assert list(frames['image']) == [0] * 5 + [1] * 5
+
+
+def test_scaled_cache(disp):
+    stim = make_stimulus([0, 1, 2])
+    disp.run(stim)
+    full = disp.memory_usage()
+    assert full > 0
+    disp.set_scaled_cache(full / 1024 / 1024 / 2)
+    assert 0 < disp.memory_usage() <= full / 2
+    disp.reset()
+    assert disp.memory_usage() == 0
+
+
+def test_stream(disp):
+    stim = make_stimulus(orders.block_random([0, 1, 2], seed=3), 30)
+    disp.run(stim)
+    shown = disp.last_run_timing().frames['image']
+    assert list(shown) == list(stim.order.realized()[:30])
+    disp.run(stim) # Shows the same order again
+    assert list(disp.last_run_timing().frames['image']) == list(shown)
+
+
+def test_stream_ends_early(disp):
+    pl = playlist.Playlist()
+    pl.add(make_stimulus([0, 1]))
+    pl.add(make_stimulus(iter([0, 1, 2]), 20))
+    with pytest.warns(UserWarning, match='Run cancelled'):
+        disp.run_playlist(pl)
+    frames = disp.last_run_timing().frames
+    assert list(frames['image'][:5]) == [0, 1, 0, 1, 2]
+    assert np.all(frames['image'][5:] == -1)
@@ -0,0 +1,16 @@
+import numpy as np
+from stimcore import gpio
+
+
+def test_bitmask_backend(tmp_path):
+    fn = str(tmp_path / 'gpiomem')
+    with open(fn, 'wb') as fd:
+        fd.write(b'\xff' * 4096)
+    be = gpio.BitmaskBackend(fn)
+    be.make_output(12)
+    be.write_many([3, 12, 31], [1, 0, 1])
+    be.mem.flush()
+    regs = np.fromfile(fn, '<u4')
+    assert regs[1] == 0xffffffff & ~(6 << 6) # GPFSEL1: pin 12 is output
+    assert regs[0x1c // 4] == (1 << 3) | (1 << 31)
+    assert regs[0x28 // 4] == 1 << 12
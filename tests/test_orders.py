@@ -0,0 +1,88 @@
+import itertools
+import numpy as np
+import pytest
+from stimcore import orders, stimulus
+
+
+def test_runlength():
+    rl = orders.RunLength([3, 1, 2], [2, 0, 3])
+    assert len(rl) == 5
+    assert list(rl) == [3, 3, 2, 2, 2]
+    assert rl[1] == 3 and rl[2] == 2 and rl[-1] == 2
+    assert rl[1:4] == [3, 2, 2]
+    with pytest.raises(IndexError):
+        rl[5]
+
+
+def test_runlength_in_seconds():
+    rl = orders.RunLength([0, 1, 0], [0.1, 0.1, 0.1], unit='s')
+    with pytest.raises(ValueError):
+        len(rl)
+    frames = rl.in_frames(32) # Rounding errors must not accumulate
+    assert list(frames.counts()) == [3, 3, 4]
+    assert list(frames) == [0] * 3 + [1] * 3 + [0] * 4
+
+
+def test_timed_order_at_frame_rate():
+    stim = stimulus.Stimulus()
+    stim.set_timed_order([(0, 0.1), (1, 0.1)], unit='s')
+    stim.set_refresh_rate(30)
+    assert list(stim.presentation_order().counts()) == [3, 3]
+    assert list(stim.presentation_order(50).counts()) == [5, 5]
+
+
+def test_stream_reads_lazily():
+    pulled = []
+    def gen():
+        for k in itertools.count():
+            pulled.append(k)
+            yield k % 3
+    st = orders.Stream(gen(), 100)
+    assert len(st) == 100
+    assert st[4] == 1
+    assert len(pulled) == 5
+    assert st[:3] == [0, 1, 2]
+    assert len(pulled) == 5
+    assert list(st.realized()) == [0, 1, 2, 0, 1]
+    assert len(np.asarray(st)) == 100
+
+
+def test_stream_ends_early():
+    st = orders.Stream(iter([0, 1, 2]), 5)
+    assert st[2] == 2
+    with pytest.raises(ValueError):
+        st[3]
+
+
+def test_set_order():
+    stim = stimulus.Stimulus()
+    stim.set_order(np.array([0, 1, 1]))
+    assert list(stim.presentation_order()) == [0, 1, 1]
+    with pytest.raises(ValueError):
+        stim.set_order(np.zeros((2, 2), int))
+    with pytest.raises(ValueError):
+        stim.set_order(iter([0, 1]))
+    stim.set_order(iter([0, 1]), 2)
+    assert isinstance(stim.presentation_order(), orders.Stream)
+
+
+def test_block_random():
+    a = list(orders.block_random([0, 1, 2, 3], blocks=5, hold=2, seed=7))
+    assert a == list(orders.block_random([0, 1, 2, 3], blocks=5, hold=2,
+                                         seed=7))
+    assert len(a) == 40
+    assert a[::2] == a[1::2]
+    for b in range(5):
+        assert sorted(a[8*b:8*b+8:2]) == [0, 1, 2, 3]
+
+
+@pytest.mark.parametrize('nbits', range(2, 13))
+def test_msequence(nbits):
+    period = 2**nbits - 1
+    seq = list(orders.msequence(nbits, ids=(5, 6), periods=2))
+    assert len(seq) == 2 * period
+    assert seq[:period] == seq[period:]
+    assert seq.count(6) == 2 * 2**(nbits - 1)
+    # A maximum-length sequence contains every nonzero NBITS-bit window
+    windows = set(tuple(seq[k:k+nbits]) for k in range(period))
+    assert len(windows) == period
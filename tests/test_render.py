@@ -0,0 +1,38 @@
+import numpy as np
+from PyQt5.QtGui import QImage
+from stimcore import stimulus
+
+
+def grab(widget):
+    img = widget.grab().toImage().convertToFormat(QImage.Format_RGB888)
+    h, w = img.height(), img.width()
+    ptr = img.constBits()
+    ptr.setsize(h * img.bytesPerLine())
+    ar = np.frombuffer(ptr, np.uint8).reshape(h, img.bytesPerLine())
+    return ar[:, :3*w].reshape(h, w, 3).copy() # IMG owns the data
+
+
+def test_offline_matches_live(disp, tmp_path):
+    rng = np.random.default_rng(0)
+    stim = stimulus.Stimulus()
+    stim.add_images(rng.random((4, 18, 32)))
+    stim.add_image_stack(rng.integers(0, 256, (3, 18, 32, 3), np.uint8))
+    stim.set_background((10, 20, 30))
+    stim.set_refresh_rate(100)
+    disp.add_photodiode((0, 0, 10, 10), period=3)
+    target = [100, 50, 300, 200]
+    disp.run(stim, target)
+    frames = disp.render(stim, target)
+
+    # Show each frame in the live window and compare
+    d = disp._disp
+    for k in range(d.N):
+        d.k = k
+        d.last_k = k # Do not count this as a real frame
+        d.pixmap = d.scaled_image(d.order[k])
+        assert np.array_equal(grab(d), frames[k])
+    d.k = None
+
+    # Streaming to a file gives the same frames
+    out = disp.render(stim, target, out=str(tmp_path / 'frames.npy'))
+    assert np.array_equal(out, frames)
@@ -0,0 +1,15 @@
+import numpy as np
+from stimcore import sprites
+
+
+def test_sprite_cut_off_at_edge():
+    stim = sprites.SpriteStimulus((100, 100))
+    cols = np.tile(np.arange(10, dtype=np.uint8) * 20, (10, 1))
+    sid = stim.add_sprite(cols)
+    stim.set_placements([[sid, -2.5, 0, 1], [sid, 2.5, 0, 1]])
+    # Partly left of the canvas, the sprite starts at x = -3, not -2
+    (img, x, y, _), = stim.compose(0, (0, 0, 100, 100))
+    assert (x, y, img.width()) == (0, 0, 7)
+    assert img.pixelColor(0, 0).red() == 60
+    (img, x, y, _), = stim.compose(1, (0, 0, 100, 100))
+    assert (x, img.width()) == (2, 10)
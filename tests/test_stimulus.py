@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+from stimcore import stimulus
+
+
+def test_image_stack_is_not_copied(tmp_path):
+    fn = str(tmp_path / 'stack.npy')
+    np.save(fn, np.arange(2*4*6, dtype=np.uint8).reshape(2, 4, 6))
+    stim = stimulus.Stimulus()
+    assert stim.add_image_stack(fn) == [0, 1]
+    assert isinstance(stim.images[1][0], np.memmap)
+    assert stim.get_image(1).pixelColor(5, 3).red() == 47
+    with pytest.raises(ValueError):
+        stim.add_image_stack(np.zeros((3, 8, 8), np.uint8)[:, ::2])
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+from stimcore import display, stimulus, scheduler
+
+# TEST_VSYNC needs a real OpenGL context, e.g., "xvfb-run python3 -m pytest
+# tests" with QT_QPA_PLATFORM=xcb, which uses Mesa's llvmpipe without a GPU.
+
+
+def test_vsync():
+    try:
+        disp = display.Display(full_screen=False, vsync=True,
+                               software_gl=True)
+    except ValueError:
+        pytest.skip('No OpenGL context')
+    refresh = disp._disp.refresh_rate()
+    stim = stimulus.Stimulus()
+    for v in (0.0, 1.0):
+        stim.add_image_from_array(np.full((8, 8), v))
+    stim.set_order([0, 1] * 10)
+    stim.set_refresh_rate(refresh / 2)
+    disp.run(stim)
+    disp.close()
+    assert disp._disp.frames_per_image() == 2
+    frames = disp.last_run_timing().frames
+    assert not np.any(np.isnan(frames['painted']))
+    assert not np.any(np.isnan(frames['swapped']))
+    assert np.all(frames['swapped'] >= frames['painted'])
+    # Each image is held for two refreshes
+    dt = np.median(np.diff(frames['swapped']))
+    assert abs(dt - 2 / refresh) < 0.5 / refresh
+
+
+# The rest drives the swap logic with a fake widget, without OpenGL
+
+class FakeGL:
+    swapped = display._GLDisplay.swapped
+    frames_per_image = display._GLDisplay.frames_per_image
+    frame_rate = display._GLDisplay.frame_rate
+    deadline = display._GLDisplay.deadline
+
+    def __init__(self, f_Hz=60):
+        self.stim = stimulus.Stimulus()
+        self.stim.set_refresh_rate(f_Hz)
+        self.t_block = 0
+        self.leader = None
+        self.timing = None
+        self.unswapped = None
+        self.idle_swaps = 0
+        self.k = None
+        self.painted_k = None
+        self.N = 10
+        self.updates = 0
+        self.fired = []
+        self.cancelled = None
+        self.scheduler = scheduler.SwapScheduler(self, self.timeout,
+                                                 self.refresh_rate())
+
+    def refresh_rate(self):
+        return 60
+
+    def update(self):
+        self.updates += 1
+
+    def timeout(self):
+        self.fired.append(self.scheduler.swaps - self.scheduler.swap0)
+
+    def finish(self, cancelled=False):
+        self.cancelled = cancelled
+
+
+def test_swap_scheduler():
+    w = FakeGL()
+    sch = w.scheduler
+    sch.swapped() # Swaps before START do not count
+    sch.start()
+    sch.schedule(0.05)
+    assert w.updates == 1
+    for n in range(3):
+        sch.swapped()
+    assert w.fired == [3]
+    assert w.updates == 3 # Kept repainting until the deadline
+    sch.swapped() # No deadline pending: no callback, no repaint
+    assert w.fired == [3] and w.updates == 3
+    sch.schedule(0.1)
+    sch.stop()
+    sch.swapped()
+    assert w.fired == [3]
+
+
+def test_frames_per_image():
+    w = FakeGL(25)
+    assert w.frames_per_image() == 2
+    assert w.frame_rate() == 30
+    w.stim.set_initial_delay(0.1)
+    assert w.deadline(3) == pytest.approx((6 + 3 * 2) / 60)
+    w.scheduler.start()
+    w.scheduler.schedule(w.deadline(0))
+    w.k = w.painted_k = 0
+    for n in range(6):
+        w.swapped()
+    w.scheduler.schedule(w.deadline(1)) # Held for two refreshes
+    w.swapped()
+    assert w.fired == [6]
+    w.swapped()
+    assert w.fired == [6, 8]
+
+
+def test_idle_swaps():
+    w = FakeGL()
+    w.scheduler.start()
+    w.scheduler.schedule(1 / 60)
+    w.k = 0
+    w.painted_k = -1
+    w.swapped() # Frame 0 not painted yet: does not count
+    assert w.scheduler.swaps == 0 and w.fired == []
+    assert w.updates == 2
+    w.painted_k = 0
+    w.swapped()
+    assert w.fired == [1] and w.idle_swaps == 0
+    w.k = 1
+    for n in range(60):
+        w.swapped()
+    assert w.cancelled is None
+    with pytest.warns(UserWarning, match='not painted'):
+        w.swapped()
+    assert w.cancelled
+    assert w.scheduler.swaps == 1